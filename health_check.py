@@ -6,6 +6,8 @@
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from os.path import lexists
 from pathlib import Path
 
 def check_environment():
@@ -15,7 +17,7 @@ def check_environment():
     issues = []
     
     # Проверяем .env файл
-    if not Path(".env").exists():
+    if not lexists(".env"):
         issues.append("❌ Файл .env не найден (скопируйте config.example)")
     
     # Проверяем обязательные переменные
@@ -25,9 +27,8 @@ def check_environment():
             issues.append(f"❌ Переменная {var} не установлена")
     
     # Проверяем директории
-    data_dir = Path("data")
-    if not data_dir.exists():
-        data_dir.mkdir(parents=True)
+    if not lexists("data"):
+        Path("data").mkdir(parents=True)
         print("✅ Создана директория data/")
     
     if not issues:
@@ -55,15 +56,26 @@ def check_imports():
         print(f"❌ Ошибка импорта: {e}")
         return False
 
-def check_llm_connection():
+def _load_settings():
+    """Загружает Settings один раз для всех проверок (None при ошибке)"""
+    try:
+        from src.config import Settings
+        return Settings.load()
+    except Exception as e:
+        print(f"\n❌ Ошибка загрузки настроек: {e}")
+        return None
+
+def check_llm_connection(settings, log=print):
     """Проверяет подключение к LLM"""
-    print("\n🔍 Проверка LLM подключения...")
+    log("\n🔍 Проверка LLM подключения...")
+    
+    if settings is None:
+        log("❌ Настройки не загружены")
+        return False
     
     try:
         from src.llm import LLMClient
-        from src.config import Settings
         
-        settings = Settings.load()
         client = LLMClient(
             api_key=settings.llm_api_key,
             api_base=settings.llm_api_base,
@@ -76,34 +88,36 @@ def check_llm_connection():
         ], response_json=False, temperature=0.1)
         
         if response:
-            print("✅ LLM подключение работает")
+            log("✅ LLM подключение работает")
             return True
         else:
-            print("❌ LLM не отвечает")
+            log("❌ LLM не отвечает")
             return False
             
     except Exception as e:
-        print(f"❌ Ошибка LLM подключения: {e}")
+        log(f"❌ Ошибка LLM подключения: {e}")
         return False
 
-def check_telegram_bot():
+def check_telegram_bot(settings, log=print):
     """Проверяет Telegram бота"""
-    print("\n🔍 Проверка Telegram бота...")
+    log("\n🔍 Проверка Telegram бота...")
+    
+    if settings is None:
+        log("❌ Настройки не загружены")
+        return False
     
     try:
         from telegram import Bot
-        from src.config import Settings
         
-        settings = Settings.load()
         bot = Bot(token=settings.bot_token)
         
         # Получаем информацию о боте
         bot_info = bot.get_me()
-        print(f"✅ Telegram бот: @{bot_info.username}")
+        log(f"✅ Telegram бот: @{bot_info.username}")
         return True
         
     except Exception as e:
-        print(f"❌ Ошибка Telegram бота: {e}")
+        log(f"❌ Ошибка Telegram бота: {e}")
         return False
 
 def check_file_structure():
@@ -121,10 +135,19 @@ def check_file_structure():
         "requirements.txt"
     ]
     
-    missing_files = []
-    for file_path in required_files:
-        if not Path(file_path).exists():
-            missing_files.append(file_path)
+    # Один scandir на директорию вместо stat на каждый файл
+    present = {}
+    for parent in {os.path.dirname(file_path) for file_path in required_files}:
+        try:
+            with os.scandir(parent or ".") as it:
+                present[parent] = {entry.name for entry in it}
+        except OSError:
+            present[parent] = set()
+    
+    missing_files = [
+        file_path for file_path in required_files
+        if os.path.basename(file_path) not in present[os.path.dirname(file_path)]
+    ]
     
     if not missing_files:
         print("✅ Все необходимые файлы на месте")
@@ -135,14 +158,32 @@ def check_file_structure():
             print(f"   - {file_path}")
         return False
 
-def show_system_info():
+def count_files(path):
+    """Рекурсивно считает файлы через os.scandir (тип берется из DirEntry без лишних stat)"""
+    n = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                n += 1
+            elif entry.is_dir(follow_symlinks=False):
+                n += count_files(entry.path)
+    return n
+
+def _run_buffered(check, settings):
+    """Запускает проверку, собирая ее вывод в список строк: (успех, строки)"""
+    lines = []
+    ok = check(settings, log=lambda *args: lines.append(" ".join(map(str, args))))
+    return bool(ok), lines
+
+def show_system_info(settings):
     """Показывает информацию о системе"""
     print("\n📊 Информация о системе:")
     
+    if settings is None:
+        print("❌ Настройки не загружены")
+        return
+    
     try:
-        from src.config import Settings
-        settings = Settings.load()
-        
         print(f"• Модель LLM: {settings.llm_model}")
         print(f"• Размер батча: {settings.batch_size}")
         print(f"• Порог низкой уверенности: {settings.low_conf}")
@@ -150,10 +191,9 @@ def show_system_info():
         print(f"• Уровень логирования: {settings.log_level}")
         
         # Статистика файлов
-        data_dir = Path(settings.data_dir)
-        if data_dir.exists():
-            files = list(data_dir.rglob("*"))
-            print(f"• Файлов в data/: {len([f for f in files if f.is_file()])}")
+        data_dir = settings.data_dir
+        if lexists(data_dir):
+            print(f"• Файлов в data/: {count_files(data_dir)}")
         
     except Exception as e:
         print(f"❌ Ошибка получения информации: {e}")
@@ -166,7 +206,9 @@ def main():
     checks = [
         check_file_structure,
         check_environment, 
-        check_imports,
+        check_imports
+    ]
+    settings_checks = [
         check_llm_connection,
         check_telegram_bot
     ]
@@ -176,7 +218,22 @@ def main():
         if check():
             passed += 1
     
-    show_system_info()
+    # Настройки читаем один раз и передаем в проверки. Загружаем после
+    # check_environment: импорт src.config подгружает .env в окружение
+    settings = _load_settings()
+    
+    # Сетевые проверки (LLM API, Telegram get_me) ждут ответа удаленной стороны —
+    # запускаем их параллельно, время ≈ самой долгой проверки, а не сумме.
+    # Вывод каждой проверки копится отдельно и печатается по порядку, без перемешивания строк
+    with ThreadPoolExecutor(max_workers=len(settings_checks)) as executor:
+        futures = [executor.submit(_run_buffered, check, settings) for check in settings_checks]
+        for future in futures:
+            ok, lines = future.result()
+            print("\n".join(lines))
+            passed += ok
+    checks += settings_checks
+    
+    show_system_info(settings)
     
     print("\n" + "=" * 50)
     print(f"📋 Результат: {passed}/{len(checks)} проверок пройдено")
@@ -1,16 +1,106 @@
 from __future__ import annotations
 
+import atexit
+import heapq
 import json
 import logging
+import os
+import time
+import weakref
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple
-from collections import defaultdict, Counter
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+from collections import defaultdict, deque, Counter
+from operator import itemgetter
 from datetime import datetime, timedelta
 
-import pandas as pd
+try:
+    import orjson  # быстрый (де)сериализатор; если не установлен — stdlib json
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Шаблон одного few-shot примера (пустая строка-разделитель добавляется при join)
+_FEWSHOT_TEMPLATE = 'ПРИМЕР {n}\nТЕКСТ:\n"{text}"\nОТВЕТ:\n{{"domain_id":"{domain}", "confidence":{confidence:.2f}}}\n'
+
+
+def _dumps(obj: Any, *, indent: bool = False) -> bytes:
+    """Сериализует объект в UTF-8 JSON (orjson, если доступен)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: bytes) -> Any:
+    """Парсит JSON из bytes (orjson, если доступен)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _file_size(path: Path) -> int:
+    """Размер файла в байтах (0, если файла нет)"""
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _stat_key(path: Path) -> Optional[Tuple[float, int]]:
+    """(mtime, size) файла для инвалидации кэшей (None, если файла нет)"""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _compact_jsonl(path: Path, ts_key: str, cutoff_iso: str) -> Tuple[int, int]:
+    """
+    Переписывает JSONL-журнал, отбрасывая записи с меткой ts_key не новее cutoff_iso
+    и битые строки. Возвращает (оставлено, удалено)
+    """
+    if not path.exists():
+        return 0, 0
+    
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    kept = dropped = 0
+    
+    with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+        for line in src:
+            try:
+                timestamp = _loads(line).get(ts_key)
+            except ValueError:
+                dropped += 1
+                continue
+            if isinstance(timestamp, str) and timestamp <= cutoff_iso:
+                dropped += 1
+                continue
+            # Строку копируем как есть, без повторной сериализации
+            dst.write(line if line.endswith(b"\n") else line + b"\n")
+            kept += 1
+    
+    os.replace(tmp_path, path)
+    return kept, dropped
+
+
+def _iso_cutoff(window: timedelta) -> str:
+    """
+    Граница окна в виде ISO-строки. Метки времени в feedback.jsonl пишутся
+    через datetime.isoformat() и сортируются лексикографически, поэтому
+    фильтр по времени — простое сравнение строк без datetime.fromisoformat
+    """
+    return (datetime.now() - window).isoformat()
+
+
+def _flush_at_exit(ref: "weakref.ref[FeedbackLearner]") -> None:
+    """atexit-хук: сбрасывает отложенные записи, если экземпляр еще жив"""
+    learner = ref()
+    if learner is not None:
+        learner.flush()
+
 
 class FeedbackLearner:
     """
@@ -22,11 +112,185 @@ class FeedbackLearner:
         self.data_dir = data_dir
         self.feedback_file = data_dir / "feedback.jsonl"
         self.dynamic_examples_file = data_dir / "dynamic_fewshot.json"
+        # Подтверждения (predicted == corrected) пишутся компактно и отдельно:
+        # они нужны только для статистики
+        self.confirmations_file = data_dir / "confirmations.jsonl"
         self.max_examples_per_domain = max_examples_per_domain
         
         # Создаем файлы если их нет
         self.feedback_file.parent.mkdir(parents=True, exist_ok=True)
         
+        # Скользящее окно исправлений за последние 30 дней и выбранные примеры.
+        # Файл читается один раз при старте, дальше состояние обновляется инкрементально
+        self._recent_window = timedelta(days=30)
+        self._recent: deque = deque()
+        self._domain_examples: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        
+        # Накопленные счетчики по feedback.jsonl и смещение (в байтах), до которого
+        # файл уже учтен. Сохраняются в .feedback_stats.cache, чтобы при рестарте
+        # дочитывать только новые строки
+        self.stats_cache_file = data_dir / ".feedback_stats.cache"
+        self._offset = 0
+        self._confirm_offset = 0
+        self._saved_offsets = (0, 0)
+        self._total = 0
+        self._confirmations = 0
+        self._corrections = 0
+        self._predicted = Counter()
+        self._corrected = Counter()
+        self._errors = Counter()
+        
+        # Мемоизация get_feedback_stats по (mtime, size) файлов и текущему часу
+        self._stats_cache: Optional[Dict[str, Any]] = None
+        self._stats_key: Tuple = ()
+        
+        # Запись dynamic_fewshot.json не чаще раза в _flush_interval секунд
+        self._dirty = False
+        self._last_flush = 0.0
+        self._flush_interval = 5.0
+        self._last_written_examples: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        
+        # Компакция журналов, когда файл вырастает больше порога
+        self._compact_threshold = 10 * 1024 * 1024
+        self._compact_at = self._compact_threshold
+        
+        # Готовый текст few-shot и mtime файла, из которого он получен
+        self._fewshot_cache: Tuple[int, str] = (0, "")
+        
+        self._bootstrap_from_file()
+        # Через weakref: регистрация не держит экземпляр живым до выхода из процесса
+        atexit.register(_flush_at_exit, weakref.ref(self))
+        
+    def _bootstrap_from_file(self) -> None:
+        """Восстанавливает счетчики и окно недавних исправлений (кэш + хвосты журналов)"""
+        
+        if not self.feedback_file.exists() and not self.confirmations_file.exists():
+            return
+        
+        self._load_stats_cache()
+        self._catch_up()
+        self._expire_recent()
+        self._rebuild_domain_examples()
+        
+        if self._offsets() != self._saved_offsets:
+            self._save_stats_cache()
+    
+    def _offsets(self) -> Tuple[int, int]:
+        """Смещения, до которых учтены feedback.jsonl и confirmations.jsonl"""
+        return self._offset, self._confirm_offset
+    
+    def _reset_stats(self) -> None:
+        """Сбрасывает накопленное состояние (перед полным перечитыванием файла)"""
+        
+        self._offset = 0
+        self._confirm_offset = 0
+        self._total = 0
+        self._confirmations = 0
+        self._corrections = 0
+        self._predicted = Counter()
+        self._corrected = Counter()
+        self._errors = Counter()
+        self._recent = deque()
+    
+    def _load_stats_cache(self) -> None:
+        """Загружает счетчики из .feedback_stats.cache, если он соответствует файлу"""
+        
+        try:
+            cache = _loads(self.stats_cache_file.read_bytes())
+            offset = int(cache["offset"])
+            confirm_offset = int(cache.get("confirm_offset", 0))
+            if (offset > _file_size(self.feedback_file)
+                    or confirm_offset > _file_size(self.confirmations_file)):
+                # Файл обрезали или пересоздали — кэш неактуален
+                raise ValueError("stale feedback stats cache")
+            
+            self._total = int(cache["total"])
+            self._confirmations = int(cache.get("confirmations", 0))
+            self._corrections = int(cache["corrections"])
+            self._predicted = Counter(cache["predicted"])
+            self._corrected = Counter(cache["corrected"])
+            self._errors = Counter({(pred, corr): n for pred, corr, n in cache["errors"]})
+            self._recent = deque(cache["recent"])
+            self._offset, self._confirm_offset = offset, confirm_offset
+            self._saved_offsets = self._offsets()
+        except FileNotFoundError:
+            self._reset_stats()
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring feedback stats cache: {e}")
+            self._reset_stats()
+    
+    def _save_stats_cache(self) -> None:
+        """Атомарно сохраняет счетчики и смещение в .feedback_stats.cache"""
+        
+        cache = {
+            "offset": self._offset,
+            "confirm_offset": self._confirm_offset,
+            "total": self._total,
+            "confirmations": self._confirmations,
+            "corrections": self._corrections,
+            "predicted": dict(self._predicted),
+            "corrected": dict(self._corrected),
+            "errors": [[pred, corr, n] for (pred, corr), n in self._errors.items()],
+            "recent": list(self._recent),
+        }
+        
+        tmp_path = self.stats_cache_file.with_suffix(".tmp")
+        tmp_path.write_bytes(_dumps(cache))
+        os.replace(tmp_path, self.stats_cache_file)
+        self._saved_offsets = self._offsets()
+    
+    def _account(self, entry: Dict[str, Any]) -> bool:
+        """Учитывает запись в счетчиках; возвращает True для исправлений"""
+        
+        self._total += 1
+        if not entry.get("was_correction", False):
+            return False
+        
+        predicted = entry["predicted_domain"]
+        corrected = entry["corrected_domain"]
+        self._corrections += 1
+        self._predicted[predicted] += 1
+        self._corrected[corrected] += 1
+        self._errors[(predicted, corrected)] += 1
+        return True
+    
+    def _catch_up(self) -> bool:
+        """
+        Дочитывает строки, дописанные в журналы после сохраненных смещений.
+        Возвращает True, если в feedback.jsonl появились новые записи.
+        """
+        
+        size = _file_size(self.feedback_file)
+        confirm_size = _file_size(self.confirmations_file)
+        if size < self._offset or confirm_size < self._confirm_offset:
+            # Файл стал короче (ротация/ручная правка) — пересчитываем с нуля
+            self._reset_stats()
+        
+        if confirm_size > self._confirm_offset:
+            # Подтверждения только считаем — разбирать JSON не нужно
+            with open(self.confirmations_file, "rb") as f:
+                f.seek(self._confirm_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._confirm_offset += len(line)
+                    self._confirmations += 1
+        
+        if size == self._offset:
+            return False
+        
+        recent_cutoff_iso = _iso_cutoff(self._recent_window)
+        
+        for offset, entry in self._iter_feedback(self._offset):
+            if self._account(entry):
+                timestamp = entry.get("timestamp")
+                if isinstance(timestamp, str) and timestamp > recent_cutoff_iso:
+                    self._recent.append(entry)
+            self._offset = offset
+        
+        self._expire_recent()
+        return True
+    
     def log_feedback(self, 
                     text: str, 
                     predicted_domain: str, 
@@ -35,68 +299,129 @@ class FeedbackLearner:
                     user_id: Optional[str] = None) -> None:
         """Записывает feedback от пользователя"""
         
-        feedback_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "text": text,
-            "predicted_domain": predicted_domain,
-            "corrected_domain": corrected_domain,
-            "confidence": confidence,
-            "user_id": user_id,
-            "was_correction": predicted_domain != corrected_domain
-        }
+        timestamp = datetime.now().isoformat()
+        self._stats_cache = None
         
-        # Добавляем в файл
-        with open(self.feedback_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(feedback_entry, ensure_ascii=False) + "\n")
+        if predicted_domain == corrected_domain:
+            # Подтверждение: минимальная запись без текста и user_id, только для статистики
+            with open(self.confirmations_file, "ab") as f:
+                start = f.tell()
+                f.write(_dumps({"t": timestamp, "d": corrected_domain, "c": confidence}) + b"\n")
+                end = f.tell()
+            
+            logger.info(f"Logged confirmation: {text[:50]}... -> {corrected_domain}")
+            
+            if start == self._confirm_offset:
+                self._confirm_offset = end
+                self._confirmations += 1
+            else:
+                self._catch_up()
+        else:
+            feedback_entry = {
+                "timestamp": timestamp,
+                "text": text,
+                "predicted_domain": predicted_domain,
+                "corrected_domain": corrected_domain,
+                "confidence": confidence,
+                "user_id": user_id,
+                "was_correction": True
+            }
+            
+            # Добавляем в файл
+            with open(self.feedback_file, "ab") as f:
+                start = f.tell()
+                f.write(_dumps(feedback_entry) + b"\n")
+                end = f.tell()
+                
+            logger.info(f"Logged feedback: {text[:50]}... -> {corrected_domain}")
             
-        logger.info(f"Logged feedback: {text[:50]}... -> {corrected_domain}")
+            if start == self._offset:
+                self._offset = end
+                self._account(feedback_entry)
+                self._recent.append(feedback_entry)
+                self._expire_recent()
+            else:
+                # Кто-то дописал файл параллельно — дочитываем хвост вместе с нашей записью
+                self._catch_up()
+            
+            # Обновляем динамические примеры
+            self._rebuild_domain_examples()
+            self._dirty = True
         
-        # Обновляем динамические примеры если это исправление
-        if feedback_entry["was_correction"]:
-            self._update_dynamic_examples()
+        if end > self._compact_at:
+            self.compact_feedback()
+        self._maybe_flush()
     
-    def _update_dynamic_examples(self) -> None:
-        """Обновляет динамические few-shot примеры на основе накопленного feedback"""
+    def compact_feedback(self, keep_days: int = 90) -> None:
+        """
+        Переписывает feedback.jsonl и confirmations.jsonl, оставляя записи за последние keep_days дней.
+        После компакции статистика считается по оставшимся записям.
+        Записи, дописанные другими процессами во время компакции, могут потеряться.
+        """
         
-        if not self.feedback_file.exists():
-            return
-            
-        # Загружаем весь feedback
-        feedback_data = []
-        with open(self.feedback_file, "r", encoding="utf-8") as f:
+        cutoff_iso = _iso_cutoff(timedelta(days=keep_days))
+        kept, dropped = _compact_jsonl(self.feedback_file, "timestamp", cutoff_iso)
+        confirmed_kept, confirmed_dropped = _compact_jsonl(self.confirmations_file, "t", cutoff_iso)
+        
+        # Пересчитываем счетчики по сжатым файлам
+        self._reset_stats()
+        self._catch_up()
+        self._rebuild_domain_examples()
+        self._save_stats_cache()
+        self._stats_cache = None
+        self._dirty = True
+        
+        # Если почти все записи свежие, не компактим на каждой записи
+        self._compact_at = max(self._compact_threshold, 2 * max(self._offsets()))
+        
+        logger.info(f"Compacted feedback: kept {kept + confirmed_kept}, "
+                    f"dropped {dropped + confirmed_dropped} entries older than {keep_days} days")
+    
+    def _iter_feedback(self, offset: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Построчно читает feedback.jsonl начиная с offset, не загружая файл целиком.
+        Возвращает пары (смещение конца строки, запись); недописанная последняя строка пропускается.
+        """
+        
+        with open(self.feedback_file, "rb") as f:
+            f.seek(offset)
             for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
                 try:
-                    feedback_data.append(json.loads(line.strip()))
-                except json.JSONDecodeError:
+                    yield offset, _loads(line)
+                except ValueError:  # JSONDecodeError в json и orjson
                     continue
+    
+    def _expire_recent(self) -> None:
+        """Выкидывает из окна исправления старше 30 дней"""
         
-        if not feedback_data:
-            return
-            
-        # Фильтруем только исправления за последние 30 дней
-        recent_cutoff = datetime.now() - timedelta(days=30)
-        recent_corrections = []
-        
-        for entry in feedback_data:
-            if not entry.get("was_correction", False):
-                continue
-                
-            try:
-                entry_time = datetime.fromisoformat(entry["timestamp"])
-                if entry_time > recent_cutoff:
-                    recent_corrections.append(entry)
-            except (ValueError, KeyError):
-                continue
+        recent_cutoff_iso = _iso_cutoff(self._recent_window)
+        while self._recent and self._recent[0].get("timestamp", "") <= recent_cutoff_iso:
+            self._recent.popleft()
+    
+    def _rebuild_domain_examples(self) -> None:
+        """Пересобирает примеры по доменам из окна недавних исправлений (без чтения файла)"""
         
-        # Группируем по доменам и выбираем лучшие примеры
+        recent_corrections = list(self._recent)
         domain_examples = defaultdict(list)
         
+        # Группируем исправления по тексту один раз, чтобы не фильтровать список на каждый пример
+        by_text = defaultdict(list)
+        for correction in recent_corrections:
+            by_text[correction["text"]].append(correction)
+        
         for correction in recent_corrections:
             domain = correction["corrected_domain"]
             text = correction["text"]
             
+            # Ограничиваем количество примеров на домен
+            if len(domain_examples[domain]) >= self.max_examples_per_domain:
+                continue
+            
             # Добавляем пример если он качественный
-            if self._is_good_example(text, domain, recent_corrections):
+            if self._is_good_example(text, by_text[text]):
                 domain_examples[domain].append({
                     "text": text,
                     "domain": domain,
@@ -104,24 +429,56 @@ class FeedbackLearner:
                     "source": "user_feedback"
                 })
         
-        # Ограничиваем количество примеров на домен
-        for domain in domain_examples:
-            domain_examples[domain] = domain_examples[domain][:self.max_examples_per_domain]
+        self._domain_examples = domain_examples
+    
+    def _maybe_flush(self) -> None:
+        """Сбрасывает примеры на диск, если с прошлой записи прошло достаточно времени"""
+        
+        if time.monotonic() - self._last_flush > self._flush_interval:
+            self.flush()
+    
+    def flush(self) -> None:
+        """Принудительно записывает отложенные изменения dynamic_fewshot.json"""
+        
+        if self._dirty:
+            self._update_dynamic_examples()
+        if self._offsets() != self._saved_offsets:
+            self._save_stats_cache()
+        self._last_flush = time.monotonic()
+    
+    def _update_dynamic_examples(self) -> None:
+        """Сохраняет динамические few-shot примеры из in-memory состояния"""
+        
+        domain_examples = {domain: list(examples) for domain, examples in self._domain_examples.items() if examples}
+        
+        # Новое исправление часто не меняет отбор (домен уже заполнен) — не переписываем файл
+        if domain_examples == self._last_written_examples and self.dynamic_examples_file.exists():
+            self._dirty = False
+            return
         
-        # Сохраняем динамические примеры
         dynamic_examples = {
             "updated_at": datetime.now().isoformat(),
-            "examples_by_domain": dict(domain_examples),
-            "total_corrections": len(recent_corrections)
+            "examples_by_domain": domain_examples,
+            "total_corrections": len(self._recent)
         }
         
-        with open(self.dynamic_examples_file, "w", encoding="utf-8") as f:
-            json.dump(dynamic_examples, f, ensure_ascii=False, indent=2)
+        # Файл читается только программно — пишем компактно (с отступами только в debug).
+        # Через временный файл + os.replace, чтобы читатель не увидел недописанный JSON
+        tmp_path = self.dynamic_examples_file.with_suffix(".tmp")
+        tmp_path.write_bytes(_dumps(dynamic_examples, indent=logger.isEnabledFor(logging.DEBUG)))
+        os.replace(tmp_path, self.dynamic_examples_file)
+        
+        self._last_written_examples = domain_examples
+        self._fewshot_cache = (
+            os.stat(self.dynamic_examples_file).st_mtime_ns,
+            self._format_fewshot(domain_examples),
+        )
+        self._dirty = False
             
         logger.info(f"Updated dynamic examples: {len(domain_examples)} domains, "
                    f"{sum(len(examples) for examples in domain_examples.values())} examples")
     
-    def _is_good_example(self, text: str, domain: str, all_corrections: List[Dict]) -> bool:
+    def _is_good_example(self, text: str, text_corrections: List[Dict]) -> bool:
         """Определяет, является ли пример качественным для few-shot"""
         
         # Фильтры качества
@@ -132,7 +489,7 @@ class FeedbackLearner:
             return False
             
         # Проверяем, что этот текст не исправлялся в разные стороны
-        text_corrections = [c for c in all_corrections if c["text"] == text]
+        # (text_corrections — все недавние исправления этого текста)
         if len(text_corrections) > 1:
             # Если есть противоречивые исправления - пропускаем
             domains = set(c["corrected_domain"] for c in text_corrections)
@@ -144,70 +501,81 @@ class FeedbackLearner:
     def get_dynamic_fewshot(self) -> str:
         """Возвращает динамически сгенерированные few-shot примеры"""
         
-        if not self.dynamic_examples_file.exists():
+        # Отложенные изменения должны быть видны читателю
+        self.flush()
+        
+        try:
+            mtime = os.stat(self.dynamic_examples_file).st_mtime_ns
+        except FileNotFoundError:
             return ""
+        
+        # Строка собирается при записи файла; перечитываем только если файл изменился извне
+        if mtime == self._fewshot_cache[0]:
+            return self._fewshot_cache[1]
             
         try:
-            with open(self.dynamic_examples_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
+            data = _loads(self.dynamic_examples_file.read_bytes())
+        except (ValueError, FileNotFoundError):
             return ""
         
-        examples_by_domain = data.get("examples_by_domain", {})
+        fewshot = self._format_fewshot(data.get("examples_by_domain", {}))
+        self._fewshot_cache = (mtime, fewshot)
+        return fewshot
+    
+    @staticmethod
+    def _format_fewshot(examples_by_domain: Dict[str, List[Dict[str, Any]]]) -> str:
+        """Формирует текст few-shot примеров"""
+        
         if not examples_by_domain:
             return ""
         
-        # Формируем few-shot примеры
-        fewshot_parts = []
-        example_num = 1
-        
-        for domain, examples in examples_by_domain.items():
-            for example in examples:
-                fewshot_parts.append(f"ПРИМЕР {example_num}")
-                fewshot_parts.append("ТЕКСТ:")
-                fewshot_parts.append(f'"{example["text"]}"')
-                fewshot_parts.append("ОТВЕТ:")
-                fewshot_parts.append(f'{{"domain_id":"{domain}", "confidence":{example["confidence"]:.2f}}}')
-                fewshot_parts.append("")
-                example_num += 1
-        
-        return "\n".join(fewshot_parts)
+        examples = (
+            (domain, example)
+            for domain, domain_examples in examples_by_domain.items()
+            for example in domain_examples
+        )
+        return "\n".join(
+            _FEWSHOT_TEMPLATE.format(n=n, text=example["text"], domain=domain, confidence=example["confidence"])
+            for n, (domain, example) in enumerate(examples, 1)
+        )
     
     def get_feedback_stats(self) -> Dict[str, Any]:
         """Возвращает статистику по feedback"""
         
-        if not self.feedback_file.exists():
+        if not self.feedback_file.exists() and not self.confirmations_file.exists():
             return {"total_feedback": 0, "corrections": 0, "domains": {}}
-            
-        feedback_data = []
-        with open(self.feedback_file, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    feedback_data.append(json.loads(line.strip()))
-                except json.JSONDecodeError:
-                    continue
         
-        corrections = [f for f in feedback_data if f.get("was_correction", False)]
-        
-        # Статистика по доменам
-        predicted_domains = Counter(f["predicted_domain"] for f in corrections)
-        corrected_domains = Counter(f["corrected_domain"] for f in corrections)
-        
-        # Матрица ошибок (топ проблемных переходов)
-        error_matrix = Counter()
-        for correction in corrections:
-            error_matrix[(correction["predicted_domain"], correction["corrected_domain"])] += 1
-        
-        return {
-            "total_feedback": len(feedback_data),
-            "corrections": len(corrections),
-            "correction_rate": len(corrections) / len(feedback_data) if feedback_data else 0,
-            "predicted_domains": dict(predicted_domains),
-            "corrected_domains": dict(corrected_domains),
-            "top_errors": dict(error_matrix.most_common(10)),
-            "recent_corrections": len([c for c in corrections 
-                                     if datetime.fromisoformat(c["timestamp"]) > datetime.now() - timedelta(days=7)])
+        # Час в ключе: без новых записей окно «последние 7 дней» все равно сдвигается
+        key = (_stat_key(self.feedback_file), _stat_key(self.confirmations_file), int(time.time() // 3600))
+        if self._stats_cache is not None and key == self._stats_key:
+            return self._stats_copy()
+        
+        # Дочитываем записи, дописанные другими процессами
+        if self._catch_up():
+            self._rebuild_domain_examples()
+            self._dirty = True
+        
+        # Окно _recent (30 дней) покрывает последние 7 дней
+        recent_cutoff_iso = _iso_cutoff(timedelta(days=7))
+        recent_corrections = sum(1 for c in self._recent if c.get("timestamp", "") > recent_cutoff_iso)
+        
+        total = self._total + self._confirmations
+        self._stats_cache = {
+            "total_feedback": total,
+            "corrections": self._corrections,
+            "correction_rate": self._corrections / total if total else 0,
+            "predicted_domains": dict(self._predicted),
+            "corrected_domains": dict(self._corrected),
+            "top_errors": dict(heapq.nlargest(10, self._errors.items(), key=itemgetter(1))),  # Матрица ошибок (топ проблемных переходов)
+            "recent_corrections": recent_corrections
         }
+        self._stats_key = key
+        
+        return self._stats_copy()
+    
+    def _stats_copy(self) -> Dict[str, Any]:
+        """Копия мемоизированной статистики: вызывающий код может ее менять"""
+        return {k: dict(v) if isinstance(v, dict) else v for k, v in self._stats_cache.items()}
 
 
 class PromptOptimizer:
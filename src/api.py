@@ -6,14 +6,24 @@ FastAPI Backend Service для ML Data Pipeline
 
 from __future__ import annotations
 
+import asyncio
 import logging
+import shutil
+import tempfile
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
+import pandas as pd
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
+try:
+    import zstandard  # сжатие датасетов при скачивании; без него отдаём обычный JSONL
+except ImportError:
+    zstandard = None
+
 from .pipeline import (
     ETLProcessor, ETLConfig,
     LabelerAgent, LabelerConfig,
@@ -25,6 +35,8 @@ from .pipeline import (
 )
 from .pipeline.labeler_validator import LabelerValidator, ValidationConfig
 from .config_v2 import Settings
+from .cache import init_semantic_cache
+from .llm import aclose_shared_clients
 
 # Настройка логирования
 logging.basicConfig(
@@ -36,11 +48,26 @@ logger = logging.getLogger(__name__)
 # Загружаем настройки
 settings = Settings.load()
 
+# Размер блока при сохранении загружаемых файлов
+UPLOAD_CHUNK_SIZE = 1 << 20
+ZSTD_LEVEL = 3
+
+# Семантический кэш аугментаций (опционально, требует sentence-transformers)
+if settings.cache.enabled and settings.cache.semantic_enabled:
+    init_semantic_cache(
+        settings.app.data_dir,
+        threshold=settings.cache.semantic_threshold,
+        model_name=settings.cache.semantic_model,
+        ttl_hours=settings.cache.ttl_hours,
+    )
+
 # Инициализация FastAPI
 app = FastAPI(
     title="ESK ML Data Pipeline API",
     description="Backend сервис для обработки логов и создания датасетов",
-    version="2.0.0"
+    version="2.0.0",
+    # orjson вместо stdlib json для всех JSON-ответов (версии, статистика, результаты /process)
+    default_response_class=ORJSONResponse,
 )
 
 # Глобальные компоненты
@@ -122,6 +149,13 @@ async def startup_event():
     logger.info("All components initialized successfully")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Закрывает общий асинхронный HTTP-пул LLM-клиентов (синхронный закрывается в atexit)"""
+    await aclose_shared_clients()
+    logger.info("Shared LLM HTTP clients closed")
+
+
 # ==================== Pydantic Models ====================
 
 class ProcessRequest(BaseModel):
@@ -200,19 +234,21 @@ async def health_check():
     }
 
 
+def _save_upload(src, file_path: Path) -> int:
+    """Синхронно копирует загруженный поток в файл блоками, возвращает размер"""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(src, f, UPLOAD_CHUNK_SIZE)
+        return f.tell()
+
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     """Загрузка файла для обработки"""
     try:
-        # Сохраняем файл
-        upload_dir = settings.app.data_dir / "uploads"
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        
-        file_path = upload_dir / file.filename
-        
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Сохраняем файл целиком в пуле потоков (одна задача вместо await на каждый блок)
+        file_path = settings.app.data_dir / "uploads" / file.filename
+        size = await run_in_threadpool(_save_upload, file.file, file_path)
         
         logger.info(f"File uploaded: {file_path}")
         
@@ -220,7 +256,7 @@ async def upload_file(file: UploadFile = File(...)):
             "status": "success",
             "filename": file.filename,
             "path": str(file_path),
-            "size": len(content)
+            "size": size
         }
     
     except Exception as e:
@@ -228,6 +264,26 @@ async def upload_file(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _read_chunks(chunks: Iterator[pd.DataFrame], queue: asyncio.Queue) -> None:
+    """Читает файл чанками в пуле потоков и кладет их в очередь (None — конец, Exception — ошибка)"""
+    try:
+        while True:
+            step = asyncio.ensure_future(run_in_threadpool(next, chunks, None))
+            try:
+                chunk = await asyncio.shield(step)
+            except asyncio.CancelledError:
+                # Ждем текущий next(): генератор нельзя закрыть, пока он выполняется в потоке
+                await asyncio.gather(step, return_exceptions=True)
+                raise
+            if chunk is None:
+                break
+            await queue.put(chunk)
+    except Exception as e:
+        await queue.put(e)
+    else:
+        await queue.put(None)
+
+
 @app.post("/process", response_model=ProcessResponse)
 async def process_logs(request: ProcessRequest, background_tasks: BackgroundTasks):
     """
@@ -243,25 +299,44 @@ async def process_logs(request: ProcessRequest, background_tasks: BackgroundTask
         
         etl_config = ETLConfig(max_rows=request.max_rows)
         etl = ETLProcessor(etl_config)
-        df = etl.process_file(file_path)
         
-        if df.empty:
+        # 2. Labeling - валидация существующих меток (если есть) или новая разметка.
+        # ETL читает следующий чанк в пуле потоков, пока LLM размечает текущий
+        chunks: List[pd.DataFrame] = []
+        results = []
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+        chunk_iter = etl.iter_chunks(file_path)
+        reader = asyncio.create_task(_read_chunks(chunk_iter, queue))
+        try:
+            while (chunk := await queue.get()) is not None:
+                if isinstance(chunk, Exception):
+                    logger.error(f"Failed to read file {file_path}: {chunk}")
+                    raise HTTPException(status_code=400, detail=f"Failed to read file: {chunk}")
+                chunks.append(chunk)
+                results.extend(await labeler_agent.classify_dataframe(chunk))
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+            chunk_iter.close()
+        
+        if not chunks:
             raise HTTPException(status_code=400, detail="No data to process")
         
+        df = pd.concat(chunks, ignore_index=True)
         logger.info(f"ETL: processed {len(df)} rows")
-        
-        # 2. Labeling - валидация существующих меток (если есть) или новая разметка
-        results = await labeler_agent.classify_dataframe(df)
         logger.info(f"Labeling: classified {len(results)} texts")
         
         # 2.1 Валидация существующей разметки (если логи уже с метками)
         if "domain" in df.columns or "label" in df.columns:
-            original_items = []
-            for idx, row in df.iterrows():
-                original_items.append({
-                    "text": row.get("text", ""),
-                    "domain_id": row.get("domain") or row.get("label", "unknown")
-                })
+            # Берем колонки целиком вместо iterrows (без Series на каждую строку)
+            n_rows = len(df)
+            texts = df["text"].tolist() if "text" in df.columns else [""] * n_rows
+            domains = df["domain"].tolist() if "domain" in df.columns else [None] * n_rows
+            labels = df["label"].tolist() if "label" in df.columns else ["unknown"] * n_rows
+            original_items = [
+                {"text": text, "domain_id": domain or label}
+                for text, domain, label in zip(texts, domains, labels)
+            ]
             
             validation_results = await quality_control.validate_existing_labels(
                 original_items,
@@ -276,19 +351,20 @@ async def process_logs(request: ProcessRequest, background_tasks: BackgroundTask
                     results[i].domain_true = val_result.validated_domain
         
         # 3. Augmentation (опционально)
-        all_items = [r.dict() for r in results]
+        all_items = [r.model_dump() for r in results]
         synthetic_validated = []
         
         if request.augment:
             # 3.1 Генерируем синтетику из уверенных примеров
-            high_conf_items = [r.dict() for r in results if r.confidence >= 0.7]
+            # Уже сериализованные строки all_items, без повторного dump
+            high_conf_items = [item for item, r in zip(all_items, results) if r.confidence >= 0.7]
             
             synthetic = await augmenter_agent.augment_batch(high_conf_items)
             logger.info(f"Augmentation: generated {len(synthetic)} samples")
             
             # 3.2 Контроль качества синтетики (косинусное + Левенштейн)
             synthetic_validated = await quality_control.validate_and_label_synthetic(
-                synthetic_items=[s.dict() for s in synthetic],
+                synthetic_items=[s.model_dump() for s in synthetic],
                 original_items=high_conf_items,
                 labeler_agent=labeler_agent
             )
@@ -307,7 +383,10 @@ async def process_logs(request: ProcessRequest, background_tasks: BackgroundTask
         )
         writer = DataWriter(writer_config)
         
-        train_path, eval_path, stats = writer.write_datasets(
+        # Запись и версионирование — синхронный файловый I/O, выполняем в пуле потоков,
+        # чтобы не блокировать event loop для остальных запросов
+        train_path, eval_path, stats = await run_in_threadpool(
+            writer.write_datasets,
             all_items,
             dataset_name="api_processing"
         )
@@ -317,7 +396,8 @@ async def process_logs(request: ProcessRequest, background_tasks: BackgroundTask
         # 5. Storage (опционально)
         version_tag = None
         if request.create_version:
-            version = data_storage.commit_version(
+            version = await run_in_threadpool(
+                data_storage.commit_version,
                 train_path=train_path,
                 eval_path=eval_path,
                 description=f"API processing of {file_path.name}",
@@ -342,6 +422,8 @@ async def process_logs(request: ProcessRequest, background_tasks: BackgroundTask
             version_tag=version_tag
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Processing failed: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -354,7 +436,7 @@ async def classify_texts(request: ClassifyRequest):
         results = await labeler_agent.classify_batch(request.texts)
         
         return ClassifyResponse(
-            results=[r.dict() for r in results],
+            results=[r.model_dump() for r in results],
             stats=labeler_agent.get_stats()
         )
     
@@ -437,20 +519,60 @@ async def checkout_version(version_tag: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _zstd_sidecar(path: Path) -> Path:
+    """
+    Возвращает <path>.zst рядом с датасетом, сжимая его при первом запросе.
+    Версии неизменяемы, поэтому готовый файл переиспользуется, пока он не старше исходника.
+    """
+    zst_path = path.with_name(path.name + ".zst")
+    if zst_path.exists() and zst_path.stat().st_mtime >= path.stat().st_mtime:
+        return zst_path
+    # Свой временный файл на каждый запрос: параллельные скачивания не пишут в один и тот же .tmp,
+    # а атомарный replace оставляет на месте одну из целых копий
+    with open(path, "rb") as src, tempfile.NamedTemporaryFile(
+        dir=zst_path.parent, prefix=zst_path.name + ".", suffix=".tmp", delete=False
+    ) as raw:
+        tmp_path = Path(raw.name)
+        try:
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, raw, read_size=UPLOAD_CHUNK_SIZE)
+        except BaseException:
+            raw.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+    tmp_path.replace(zst_path)
+    return zst_path
+
+
+async def _dataset_response(path: Path, filename: str, compressed: bool) -> FileResponse:
+    """FileResponse для датасета; при compressed=true — zstd-сжатая копия"""
+    if compressed:
+        if zstandard is None:
+            logger.warning("zstandard is not installed, serving uncompressed %s", filename)
+        else:
+            zst_path = await run_in_threadpool(_zstd_sidecar, Path(path))
+            return FileResponse(
+                path=zst_path,
+                filename=f"{filename}.zst",
+                media_type="application/zstd"
+            )
+    
+    return FileResponse(
+        path=path,
+        filename=filename,
+        media_type="application/jsonl"
+    )
+
+
 @app.get("/download/train/{version_tag}")
-async def download_train(version_tag: str):
-    """Скачать train датасет версии"""
+async def download_train(version_tag: str, compressed: bool = False):
+    """Скачать train датасет версии (compressed=true — JSONL в zstd)"""
     try:
         version = data_storage.get_version(version_tag)
         
         if not version or not version.train_path:
             raise HTTPException(status_code=404, detail="Train dataset not found")
         
-        return FileResponse(
-            path=version.train_path,
-            filename=f"{version_tag}_train.jsonl",
-            media_type="application/jsonl"
-        )
+        return await _dataset_response(version.train_path, f"{version_tag}_train.jsonl", compressed)
     
     except HTTPException:
         raise
@@ -460,19 +582,15 @@ async def download_train(version_tag: str):
 
 
 @app.get("/download/eval/{version_tag}")
-async def download_eval(version_tag: str):
-    """Скачать eval датасет версии"""
+async def download_eval(version_tag: str, compressed: bool = False):
+    """Скачать eval датасет версии (compressed=true — JSONL в zstd)"""
     try:
         version = data_storage.get_version(version_tag)
         
         if not version or not version.eval_path:
             raise HTTPException(status_code=404, detail="Eval dataset not found")
         
-        return FileResponse(
-            path=version.eval_path,
-            filename=f"{version_tag}_eval.jsonl",
-            media_type="application/jsonl"
-        )
+        return await _dataset_response(version.eval_path, f"{version_tag}_eval.jsonl", compressed)
     
     except HTTPException:
         raise
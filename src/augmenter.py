@@ -1,57 +1,169 @@
 from __future__ import annotations
-import asyncio, json, random, math, logging
+import asyncio, json, random, math, logging, re
 from pathlib import Path
 from typing import List, Dict, Any
 from collections import defaultdict
 
-from .llm import LLMClient
-from .cache import get_cache
+try:
+    import orjson  # быстрый сериализатор JSONL; если не установлен — stdlib json
+except ImportError:
+    orjson = None
+
+from openai import RateLimitError
+
+from .llm import LLMClient, RateLimiter
+from .cache import get_cache, get_semantic_cache
 
 logger = logging.getLogger(__name__)
 
+JSONL_WRITE_BUFFER = 4 << 20
+
+# Сколько фраз одного домена аугментируется одним запросом к LLM
+AUG_BATCH_SIZE = 5
+# Сколько фраз каждого домена берётся в аугментацию
+AUG_SEEDS_PER_DOMAIN = 30
+# Как часто (в фразах) логировать прогресс аугментации
+AUG_LOG_EVERY = 200
+# Повторы при 429 поверх ретраев SDK: экспоненциальная пауза AUG_RETRY_BASE * 2**attempt + джиттер
+AUG_MAX_RETRIES = 3
+AUG_RETRY_BASE = 2.0
+_LINE_RE = re.compile(r"^[\s\-•]*(.*?)[\s\-•]*$")
+_NUMBERED_RE = re.compile(r"^\s*(\d+)[.)]\s*(.+)$")
+
 def _parse_lines(resp: str) -> list[str]:
-    lines = [ln.strip("-• ").strip() for ln in str(resp).splitlines() if ln.strip()]
-    # уберём дубликаты, ограничим
+    # уберём маркеры списка и дубликаты, ограничим
     out = []
     seen = set()
-    for s in lines:
+    for ln in str(resp).splitlines():
+        s = _LINE_RE.match(ln).group(1)
         if s and s not in seen:
             out.append(s)
             seen.add(s)
-        if len(out) >= 4:
-            break
+            if len(out) >= 4:
+                break
     return out
 
-async def _aug_one(llm: LLMClient, system_prompt: str, dom: str, text: str, *, only_pos: bool) -> list[Dict[str,Any]]:
-    # Проверяем кэш
+async def _embed_texts(texts: list[str]) -> Dict[str, Any]:
+    # Эмбеддинги для семантического кэша: одной пачкой и в пуле потоков, чтобы не блокировать event loop
+    sem_cache = get_semantic_cache()
+    if not sem_cache or not texts:
+        return {}
+    return dict(zip(texts, await asyncio.to_thread(sem_cache.embed, texts)))
+
+def _get_cached(system_prompt: str, dom: str, text: str, vector=None) -> list[Dict[str,Any]] | None:
+    # Точный кэш, затем семантический (близкий перефраз уже аугментировался) по готовому эмбеддингу
     cache = get_cache()
     if cache:
         cached_result = cache.get_augmentation(text, dom, system_prompt)
         if cached_result:
             return cached_result
-    
-    prompt = [
-        {"role":"system","content": system_prompt},
-        {"role":"user","content": f"Домен: {dom}\nФраза: {text}\n"
-                                  f"Сгенерируй 3 перефраза{' (без hard-negative)' if only_pos else ' и 1 пограничный вариант'}."}
-    ]
+    sem_cache = get_semantic_cache()
+    if sem_cache and vector is not None:
+        cached_result = sem_cache.get_augmentation(text, dom, system_prompt, vector)
+        if cached_result:
+            return cached_result
+    return None
+
+def _set_cached(system_prompt: str, dom: str, text: str, out: list[Dict[str,Any]], vector=None) -> None:
+    cache = get_cache()
+    if cache:
+        cache.set_augmentation(text, dom, system_prompt, out)
+    sem_cache = get_semantic_cache()
+    if sem_cache and out and vector is not None:
+        sem_cache.set_augmentation(text, dom, system_prompt, out, vector)
+
+async def _chat(llm: LLMClient, prompt: list[Dict[str,str]]) -> str | None:
+    # achat не блокирует event loop — иначе concurrency в augment_dataset фактически последовательная
     try:
-        resp = llm.chat(prompt, response_json=False, temperature=1.0)
+        for attempt in range(AUG_MAX_RETRIES + 1):
+            try:
+                return str(await llm.achat(prompt, response_json=False, temperature=1.0))
+            except RateLimitError:
+                if attempt == AUG_MAX_RETRIES:
+                    raise
+                # Слот семафора держим: при 429 меньше параллельных запросов — то, что нужно
+                delay = AUG_RETRY_BASE * 2 ** attempt
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
     except Exception as e:
         es = str(e)
         if "unsupported_country_region_territory" in es or "request_forbidden" in es or "403" in es:
             logger.warning("LLM 403 forbidden on augment -> skip")
-            return []
+            return None
         logger.warning("augment call failed: %s", es)
+        return None
+
+def _system_with_domain(system_prompt: str, dom: str) -> str:
+    # Системный промпт + домен — побайтно одинаковый префикс для всех фраз домена,
+    # его подхватывает prefix-кэш провайдера; меняется только короткое user-сообщение
+    return f"{system_prompt}\nДомен: {dom}"
+
+def _parse_numbered(resp: str, n: int) -> list[list[str]]:
+    """Разбирает ответ вида 'N. вариант' в списки вариантов для каждой из n фраз"""
+    grouped: list[list[str]] = [[] for _ in range(n)]
+    for ln in resp.splitlines():
+        m = _NUMBERED_RE.match(ln)
+        if m and 1 <= int(m.group(1)) <= n:
+            grouped[int(m.group(1)) - 1].append(m.group(2))
+    return [_parse_lines("\n".join(lines)) for lines in grouped]
+
+async def _aug_one(llm: LLMClient, system_prompt: str, dom: str, text: str, *, only_pos: bool, vector=None) -> list[Dict[str,Any]]:
+    if vector is None:
+        vector = (await _embed_texts([text])).get(text)
+    cached_result = _get_cached(system_prompt, dom, text, vector)
+    if cached_result:
+        return cached_result
+    
+    prompt = [
+        {"role":"system","content": _system_with_domain(system_prompt, dom)},
+        {"role":"user","content": f"Фраза: {text}\n"
+                                  f"Сгенерируй 3 перефраза{' (без hard-negative)' if only_pos else ' и 1 пограничный вариант'}."}
+    ]
+    resp = await _chat(llm, prompt)
+    if resp is None:
         return []
-    variants = _parse_lines(str(resp))
-    out = []
-    for v in variants:
-        out.append({"text": v, "domain_id": dom, "source": "aug_llm"})
+    out = [{"text": v, "domain_id": dom, "source": "aug_llm"} for v in _parse_lines(resp)]
     
-    # Сохраняем в кэш
-    if cache:
-        cache.set_augmentation(text, dom, system_prompt, out)
+    # Сохраняем в кэш (эмбеддинг уже посчитан при поиске)
+    _set_cached(system_prompt, dom, text, out, vector)
+    
+    return out
+
+async def _aug_batch(llm: LLMClient, system_prompt: str, dom: str, texts: list[str], *, only_pos: bool) -> list[Dict[str,Any]]:
+    """Аугментирует несколько фраз одного домена одним вызовом LLM"""
+    out: list[Dict[str,Any]] = []
+    pending = []
+    vectors = await _embed_texts(texts)
+    for text in texts:
+        cached_result = _get_cached(system_prompt, dom, text, vectors.get(text))
+        if cached_result:
+            out.extend(cached_result)
+        else:
+            pending.append(text)
+    
+    if len(pending) <= 1:
+        for text in pending:
+            out.extend(await _aug_one(llm, system_prompt, dom, text, only_pos=only_pos, vector=vectors.get(text)))
+        return out
+    
+    numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(pending, 1))
+    prompt = [
+        {"role":"system","content": _system_with_domain(system_prompt, dom)},
+        {"role":"user","content": f"Фразы:\n{numbered}\n"
+                                  f"Для каждой фразы сгенерируй 3 перефраза{' (без hard-negative)' if only_pos else ' и 1 пограничный вариант'}. "
+                                  f"Каждый вариант пиши с новой строки в формате 'N. вариант', где N — номер исходной фразы."}
+    ]
+    resp = await _chat(llm, prompt)
+    if resp is None:
+        return out
+    
+    for text, variants in zip(pending, _parse_numbered(resp, len(pending))):
+        if not variants:
+            # Ответ не разобрался для этой фразы — отдельный запрос
+            out.extend(await _aug_one(llm, system_prompt, dom, text, only_pos=only_pos, vector=vectors.get(text)))
+            continue
+        res = [{"text": v, "domain_id": dom, "source": "aug_llm"} for v in variants]
+        _set_cached(system_prompt, dom, text, res, vectors.get(text))
+        out.extend(res)
     
     return out
 
@@ -66,44 +178,53 @@ async def augment_dataset(
     only_positive: bool = False,
     concurrency: int = 8,
 ) -> List[Dict[str,Any]]:
-    # 1) отбор
-    if include_low_conf:
-        base = items[:]
-    else:
-        base = [r for r in items if float(r.get("confidence",0.0)) >= low_conf_threshold]
-    if not base:
-        return []
-
-    # 2) баланс по доменам и подготовка задач
-    by_dom: Dict[str, list] = defaultdict(list)
-    for r in base:
-        dom = r.get("domain_true") or r.get("domain_id") or "unknown"
+    # 1) отбор и 2) баланс по доменам — один проход по items без промежуточной копии;
+    #    храним только тексты (не dict-строки) и не больше AUG_SEEDS_PER_DOMAIN на домен
+    by_dom: Dict[str, list[str]] = defaultdict(list)
+    for r in items:
+        if not include_low_conf and float(r.get("confidence",0.0)) < low_conf_threshold:
+            continue
         text = r.get("text") or r.get("query") or ""
-        if text:
-            by_dom[dom].append(text)
+        if not text:
+            continue
+        seeds = by_dom[r.get("domain_true") or r.get("domain_id") or "unknown"]
+        if len(seeds) < AUG_SEEDS_PER_DOMAIN:
+            seeds.append(text)
+    if not by_dom:
+        return []
 
+    # подготовка задач (по AUG_BATCH_SIZE фраз одного домена на вызов);
+    # задачи идут подряд по доменам, чтобы prefix-кэш провайдера оставался горячим
     tasks = []
-    for dom, texts in by_dom.items():
-        seeds = texts[: min(30, len(texts))]
-        for t in seeds:
-            tasks.append((dom, t))
+    for dom, seeds in by_dom.items():
+        for i in range(0, len(seeds), AUG_BATCH_SIZE):
+            tasks.append((dom, seeds[i:i + AUG_BATCH_SIZE]))
+    total = sum(len(batch) for _, batch in tasks)
 
     # 3) контролируемая конкурентность
     sem = asyncio.Semaphore(max(1, concurrency))
     out: List[Dict[str,Any]] = []
     done = 0
 
-    async def _worker(dom: str, t: str):
+    log_progress = logger.isEnabledFor(logging.INFO)
+
+    limiter = RateLimiter(rate_limit)
+
+    async def _worker(dom: str, batch: list[str]):
         nonlocal done
+        async with limiter:
+            pass  # rate-gate до захвата слота
         async with sem:
-            res = await _aug_one(llm, system_prompt, dom, t, only_pos=only_positive)
-            out.extend(res)
-            done += 1
-            if done % 200 == 0 or done == len(tasks):
-                logger.info("[AUG] %d/%d", done, len(tasks))
-            await asyncio.sleep(rate_limit)
-
-    await asyncio.gather(*[ _worker(dom,t) for dom,t in tasks ])
+            res = await _aug_batch(llm, system_prompt, dom, batch, only_pos=only_positive)
+        out.extend(res)
+        prev, done = done, done + len(batch)
+        if log_progress and (done // AUG_LOG_EVERY > prev // AUG_LOG_EVERY or done == total):
+            logger.info("[AUG] %d/%d", done, total)
+
+    await asyncio.gather(*[ _worker(dom,batch) for dom,batch in tasks ])
+    for cache in (get_cache(), get_semantic_cache()):
+        if cache:
+            cache.flush()
     return out
 
 # ===== utils =====
@@ -116,24 +237,22 @@ def split_train_eval(items, eval_frac: float = 0.1, min_eval: int = 50):
         label = it.get("label") or it.get("domain_true") or it.get("domain_id") or "NA"
         by_label[label].append(it)
 
-    eval_set, train_set = [], []
+    # остатки групп для train держим по меткам: добор eval не пересчитывает метки
+    eval_set = []
+    train_by_label: Dict[str, list] = {}
     target_eval_total = max(min_eval, math.floor(len(items) * eval_frac))
 
     for label, group in by_label.items():
         if len(group) == 1:
-            train_set.extend(group)
+            train_by_label[label] = group
             continue
         random.shuffle(group)
         take = max(1, math.floor(len(group) * eval_frac))
         eval_set.extend(group[:take])
-        train_set.extend(group[take:])
+        train_by_label[label] = group[take:]
 
     if len(eval_set) < target_eval_total:
         deficit = target_eval_total - len(eval_set)
-        train_by_label = defaultdict(list)
-        for it in train_set:
-            l = it.get("label") or it.get("domain_true") or it.get("domain_id") or "NA"
-            train_by_label[l].append(it)
         for label, group in sorted(train_by_label.items(), key=lambda kv: len(kv[1]), reverse=True):
             if deficit <= 0:
                 break
@@ -142,17 +261,30 @@ def split_train_eval(items, eval_frac: float = 0.1, min_eval: int = 50):
                 eval_set.extend(group[:move])
                 train_by_label[label] = group[move:]
                 deficit -= move
-        train_set = [it for grp in train_by_label.values() for it in grp]
+    train_set = [it for grp in train_by_label.values() for it in grp]
     return train_set, eval_set
 
+def _dumps_line(row) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(row) + b"\n"
+    return (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+
 def write_jsonl(path: Path, rows) -> bool:
+    """Пишет rows (список или генератор) в JSONL потоково; пустой вход — файл удаляется"""
     path.parent.mkdir(parents=True, exist_ok=True)
-    if not rows:
-        if path.exists():
-            path.unlink()
-        return False
-    with open(path, "w", encoding="utf-8") as f:
+    # Сериализуем в bytes и пишем блоками ~JSONL_WRITE_BUFFER;
+    # rows не материализуется, поэтому можно передавать генератор
+    buf = bytearray()
+    written = False
+    with open(path, "wb") as f:
         for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
-    return True
-
+            buf += _dumps_line(r)
+            written = True
+            if len(buf) >= JSONL_WRITE_BUFFER:
+                f.write(buf)
+                buf.clear()
+        if buf:
+            f.write(buf)
+    if not written:
+        path.unlink()
+    return written
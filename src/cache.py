@@ -1,14 +1,54 @@
 from __future__ import annotations
 
+import atexit
+import functools
 import hashlib
 import json
 import logging
+import time
 from pathlib import Path
-from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, Any, List, Optional
+from datetime import datetime
+
+try:
+    import orjson  # быстрая сериализация JSONL; если не установлен — stdlib json
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash  # быстрый хеш ключей кэша; если не установлен — md5
+except ImportError:
+    xxhash = None
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer  # опционально: семантический кэш
+except ImportError:
+    np = None
+    SentenceTransformer = None
 
 logger = logging.getLogger(__name__)
 
+# Записи кэша копятся в буфере открытого файла и сбрасываются на диск пачками
+CACHE_WRITE_BUFFER = 1 << 16
+CACHE_FLUSH_EVERY = 100
+
+# Алгоритм ключей новых записей; сохраняется в записи, чтобы находить старые md5-ключи
+KEY_HASH = "xxh3" if xxhash is not None else "md5"
+
+
+@functools.lru_cache(maxsize=32)
+def _prompt_hash(system_prompt: str) -> str:
+    """Короткий хеш системного промпта (промпт один на весь прогон — считаем один раз)"""
+    return hashlib.md5(system_prompt.encode()).hexdigest()[:8]
+
+
+def _jsonl_line(entry: Dict[str, Any]) -> bytes:
+    """Строка JSONL в UTF-8: orjson, если установлен, иначе stdlib json"""
+    if orjson is not None:
+        return orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
 
 class LLMCache:
     """
@@ -29,76 +69,128 @@ class LLMCache:
         self._classification_cache = {}
         self._augmentation_cache = {}
         
+        # Открытые на дозапись файлы кэша и число записей с последнего flush
+        self._files: Dict[Path, BinaryIO] = {}
+        self._pending = 0
+        
+        # Есть ли записи с ключами старого алгоритма (md5) — тогда при промахе проверяем и их
+        self._legacy_keys = False
+        
         # Загружаем кэш при инициализации
         self._load_caches()
+        
+        atexit.register(self.close)
     
-    def _generate_key(self, text: str, system_prompt: str, fewshot: str = "") -> str:
-        """Генерирует ключ кэша на основе входных данных"""
-        combined = f"{text}|{system_prompt}|{fewshot}"
-        return hashlib.md5(combined.encode('utf-8')).hexdigest()
+    def _generate_key(self, text: str, system_prompt: str, fewshot: str = "", *, legacy: bool = False) -> str:
+        """Генерирует ключ кэша на основе входных данных (legacy=True — старый md5-ключ)"""
+        combined = f"{text}|{system_prompt}|{fewshot}".encode('utf-8')
+        if xxhash is not None and not legacy:
+            return xxhash.xxh3_128_hexdigest(combined)
+        return hashlib.md5(combined).hexdigest()
     
-    def _is_expired(self, timestamp: str) -> bool:
-        """Проверяет, истек ли TTL записи"""
-        try:
-            cached_time = datetime.fromisoformat(timestamp)
-            return datetime.now() - cached_time > timedelta(hours=self.ttl_hours)
-        except (ValueError, TypeError):
-            return True
+    def _lookup(self, cache: Dict[str, Any], text: str, system_prompt: str, fewshot: str = "") -> Optional[Any]:
+        """Ищет запись по ключу (и по старому md5-ключу, пока такие записи есть), учитывая TTL"""
+        key = self._generate_key(text, system_prompt, fewshot)
+        entry = cache.get(key)
+        if entry is None and self._legacy_keys:
+            key = self._generate_key(text, system_prompt, fewshot, legacy=True)
+            entry = cache.get(key)
+        if entry is None:
+            return None
+        
+        if not self._is_expired(entry):
+            return entry["result"]
+        
+        # Удаляем просроченную запись
+        del cache[key]
+        return None
+    
+    def _cutoff(self) -> float:
+        """Записи со временем (epoch) меньше этого значения просрочены"""
+        return time.time() - self.ttl_hours * 3600
+    
+    def _is_expired(self, entry: Dict[str, Any], cutoff: Optional[float] = None) -> bool:
+        """Проверяет, истек ли TTL записи (сравнение epoch-секунд, без разбора дат)"""
+        return entry["ts"] < (self._cutoff() if cutoff is None else cutoff)
+    
+    @staticmethod
+    def _entry_ts(entry: Dict[str, Any]) -> float:
+        """Время записи в epoch-секундах; старые записи хранят ISO-строку timestamp"""
+        ts = entry.get("ts")
+        if ts is None:
+            ts = datetime.fromisoformat(entry.get("timestamp", "")).timestamp()
+        return float(ts)
     
     def _load_caches(self) -> None:
         """Загружает кэши из файлов"""
-        # Загружаем кэш классификации
-        if self.classification_cache_file.exists():
-            try:
-                with open(self.classification_cache_file, "r", encoding="utf-8") as f:
-                    for line in f:
-                        try:
-                            entry = json.loads(line.strip())
-                            if not self._is_expired(entry.get("timestamp", "")):
-                                self._classification_cache[entry["key"]] = entry
-                        except json.JSONDecodeError:
-                            continue
-                logger.info(f"Loaded {len(self._classification_cache)} classification cache entries")
-            except Exception as e:
-                logger.warning(f"Failed to load classification cache: {e}")
+        self._load_cache_file(self.classification_cache_file, self._classification_cache, "classification")
+        self._load_cache_file(self.augmentation_cache_file, self._augmentation_cache, "augmentation")
+    
+    def _load_cache_file(self, file_path: Path, cache: Dict[str, Any], name: str) -> None:
+        """Читает файл кэша одним read() и разбирает строки (orjson, если установлен)"""
+        if not file_path.exists():
+            return
         
-        # Загружаем кэш аугментации
-        if self.augmentation_cache_file.exists():
-            try:
-                with open(self.augmentation_cache_file, "r", encoding="utf-8") as f:
-                    for line in f:
-                        try:
-                            entry = json.loads(line.strip())
-                            if not self._is_expired(entry.get("timestamp", "")):
-                                self._augmentation_cache[entry["key"]] = entry
-                        except json.JSONDecodeError:
-                            continue
-                logger.info(f"Loaded {len(self._augmentation_cache)} augmentation cache entries")
-            except Exception as e:
-                logger.warning(f"Failed to load augmentation cache: {e}")
+        loads = orjson.loads if orjson is not None else json.loads
+        cutoff = self._cutoff()
+        try:
+            for line in file_path.read_bytes().splitlines():
+                if not line:
+                    continue
+                try:
+                    entry = loads(line)
+                    # старые записи: ISO timestamp переводим в ts один раз при загрузке
+                    entry["ts"] = self._entry_ts(entry)
+                    if self._is_expired(entry, cutoff):
+                        continue
+                except (ValueError, TypeError):
+                    # битая строка или метка времени — как и просроченная запись, пропускаем
+                    continue
+                cache[entry["key"]] = entry
+                if KEY_HASH != "md5" and entry.get("key_hash", "md5") == "md5":
+                    self._legacy_keys = True
+            logger.info(f"Loaded {len(cache)} {name} cache entries")
+        except Exception as e:
+            logger.warning(f"Failed to load {name} cache: {e}")
     
     def _save_cache_entry(self, file_path: Path, entry: Dict[str, Any]) -> None:
-        """Сохраняет запись в файл кэша"""
+        """Дописывает запись в буфер файла кэша; на диск — каждые CACHE_FLUSH_EVERY записей"""
         try:
-            with open(file_path, "a", encoding="utf-8") as f:
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f = self._files.get(file_path)
+            if f is None:
+                f = self._files[file_path] = open(file_path, "ab", buffering=CACHE_WRITE_BUFFER)
+            f.write(_jsonl_line(entry))
+            self._pending += 1
+            if self._pending >= CACHE_FLUSH_EVERY:
+                self.flush()
         except Exception as e:
             logger.warning(f"Failed to save cache entry: {e}")
     
+    def flush(self) -> None:
+        """Сбрасывает накопленные записи кэша на диск"""
+        for f in self._files.values():
+            try:
+                f.flush()
+            except Exception as e:
+                logger.warning(f"Failed to flush cache file: {e}")
+        self._pending = 0
+    
+    def close(self) -> None:
+        """Сбрасывает буферы и закрывает файлы кэша"""
+        self.flush()
+        for f in self._files.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+        self._files.clear()
+    
     def get_classification(self, text: str, system_prompt: str, fewshot: str) -> Optional[Dict[str, Any]]:
         """Получает результат классификации из кэша"""
-        key = self._generate_key(text, system_prompt, fewshot)
-        
-        if key in self._classification_cache:
-            entry = self._classification_cache[key]
-            if not self._is_expired(entry.get("timestamp", "")):
-                logger.debug(f"Cache hit for classification: {text[:50]}...")
-                return entry["result"]
-            else:
-                # Удаляем просроченную запись
-                del self._classification_cache[key]
-        
-        return None
+        result = self._lookup(self._classification_cache, text, system_prompt, fewshot)
+        if result is not None:
+            logger.debug(f"Cache hit for classification: {text[:50]}...")
+        return result
     
     def set_classification(self, text: str, system_prompt: str, fewshot: str, result: Dict[str, Any]) -> None:
         """Сохраняет результат классификации в кэш"""
@@ -107,9 +199,10 @@ class LLMCache:
         entry = {
             "key": key,
             "text": text,
-            "system_prompt_hash": hashlib.md5(system_prompt.encode()).hexdigest()[:8],
+            "system_prompt_hash": _prompt_hash(system_prompt),
+            "key_hash": KEY_HASH,
             "result": result,
-            "timestamp": datetime.now().isoformat()
+            "ts": time.time()
         }
         
         self._classification_cache[key] = entry
@@ -118,17 +211,10 @@ class LLMCache:
     
     def get_augmentation(self, text: str, domain: str, system_prompt: str) -> Optional[list]:
         """Получает результат аугментации из кэша"""
-        key = self._generate_key(f"{text}|{domain}", system_prompt)
-        
-        if key in self._augmentation_cache:
-            entry = self._augmentation_cache[key]
-            if not self._is_expired(entry.get("timestamp", "")):
-                logger.debug(f"Cache hit for augmentation: {text[:50]}...")
-                return entry["result"]
-            else:
-                del self._augmentation_cache[key]
-        
-        return None
+        result = self._lookup(self._augmentation_cache, f"{text}|{domain}", system_prompt)
+        if result is not None:
+            logger.debug(f"Cache hit for augmentation: {text[:50]}...")
+        return result
     
     def set_augmentation(self, text: str, domain: str, system_prompt: str, result: list) -> None:
         """Сохраняет результат аугментации в кэш"""
@@ -138,9 +224,10 @@ class LLMCache:
             "key": key,
             "text": text,
             "domain": domain,
-            "system_prompt_hash": hashlib.md5(system_prompt.encode()).hexdigest()[:8],
+            "system_prompt_hash": _prompt_hash(system_prompt),
+            "key_hash": KEY_HASH,
             "result": result,
-            "timestamp": datetime.now().isoformat()
+            "ts": time.time()
         }
         
         self._augmentation_cache[key] = entry
@@ -150,26 +237,13 @@ class LLMCache:
     def cleanup_expired(self) -> int:
         """Очищает просроченные записи из кэша"""
         cleaned_count = 0
+        cutoff = self._cutoff()
         
-        # Очищаем кэш классификации
-        expired_keys = []
-        for key, entry in self._classification_cache.items():
-            if self._is_expired(entry.get("timestamp", "")):
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del self._classification_cache[key]
-            cleaned_count += 1
-        
-        # Очищаем кэш аугментации
-        expired_keys = []
-        for key, entry in self._augmentation_cache.items():
-            if self._is_expired(entry.get("timestamp", "")):
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del self._augmentation_cache[key]
-            cleaned_count += 1
+        for cache in (self._classification_cache, self._augmentation_cache):
+            expired_keys = [key for key, entry in cache.items() if self._is_expired(entry, cutoff)]
+            for key in expired_keys:
+                del cache[key]
+            cleaned_count += len(expired_keys)
         
         if cleaned_count > 0:
             logger.info(f"Cleaned up {cleaned_count} expired cache entries")
@@ -186,8 +260,164 @@ class LLMCache:
         }
 
 
+class SemanticCache:
+    """
+    Семантический кэш аугментаций: находит ранее обработанную фразу того же
+    домена и промпта с косинусной близостью эмбеддингов >= threshold.
+    Дополняет точный LLMCache для перефразов, которые часто встречаются в логах.
+    
+    Эмбеддинг считается на CPU и блокирует поток: из async-кода его стоит
+    считать один раз через embed() в пуле потоков и передавать в get/set как vector.
+    """
+    
+    DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    
+    def __init__(self, cache_dir: Path, threshold: float = 0.92, model_name: str = DEFAULT_MODEL,
+                 ttl_hours: int = 24):
+        if SentenceTransformer is None:
+            raise ImportError("SemanticCache requires numpy and sentence-transformers")
+        
+        self.cache_dir = cache_dir / "llm_cache"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_file = self.cache_dir / "semantic_cache.jsonl"
+        self.threshold = threshold
+        self.ttl_hours = ttl_hours
+        self.model = SentenceTransformer(model_name)
+        
+        # namespace (домен + хэш промпта) -> эмбеддинги, результаты и время записи
+        # (записи идут в порядке добавления, поэтому самая старая — первая)
+        self._vectors: Dict[str, List[Any]] = {}
+        self._results: Dict[str, List[list]] = {}
+        self._ts: Dict[str, List[float]] = {}
+        self._matrices: Dict[str, Any] = {}
+        
+        # Открытый на дозапись файл кэша и число записей с последнего flush
+        self._file: Optional[BinaryIO] = None
+        self._pending = 0
+        
+        self._load()
+        
+        atexit.register(self.close)
+    
+    @staticmethod
+    def _namespace(domain: str, system_prompt: str) -> str:
+        return f"{domain}|{_prompt_hash(system_prompt)}"
+    
+    def _cutoff(self) -> float:
+        """Записи со временем (epoch) меньше этого значения просрочены"""
+        return time.time() - self.ttl_hours * 3600
+    
+    def embed(self, texts: List[str]):
+        """Нормализованные эмбеддинги фраз одной пачкой (матрица len(texts) x dim)"""
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+    
+    def _append(self, namespace: str, vector, result: list, ts: float) -> None:
+        self._vectors.setdefault(namespace, []).append(vector)
+        self._results.setdefault(namespace, []).append(result)
+        self._ts.setdefault(namespace, []).append(ts)
+        self._matrices.pop(namespace, None)  # матрица пересоберется при следующем запросе
+    
+    def _prune(self, namespace: str, cutoff: float) -> None:
+        """Удаляет просроченные записи пространства имен"""
+        ts = self._ts[namespace]
+        keep = [i for i, t in enumerate(ts) if t >= cutoff]
+        self._vectors[namespace] = [self._vectors[namespace][i] for i in keep]
+        self._results[namespace] = [self._results[namespace][i] for i in keep]
+        self._ts[namespace] = [ts[i] for i in keep]
+        self._matrices.pop(namespace, None)
+    
+    def _load(self) -> None:
+        """Загружает сохраненные эмбеддинги и результаты одним read() (orjson, если установлен)"""
+        if not self.cache_file.exists():
+            return
+        
+        loads = orjson.loads if orjson is not None else json.loads
+        cutoff = self._cutoff()
+        try:
+            for line in self.cache_file.read_bytes().splitlines():
+                if not line:
+                    continue
+                try:
+                    entry = loads(line)
+                    # записи без ts (до появления TTL) считаем просроченными
+                    ts = float(entry.get("ts", 0.0))
+                    if ts < cutoff:
+                        continue
+                    self._append(entry["ns"], np.asarray(entry["vec"], dtype=np.float32), entry["result"], ts)
+                except (ValueError, TypeError, KeyError):
+                    continue
+            logger.info(f"Loaded {sum(len(r) for r in self._results.values())} semantic cache entries")
+        except Exception as e:
+            logger.warning(f"Failed to load semantic cache: {e}")
+    
+    def get_augmentation(self, text: str, domain: str, system_prompt: str, vector=None) -> Optional[list]:
+        """Возвращает результат аугментации для семантически близкой фразы (vector — готовый эмбеддинг text)"""
+        namespace = self._namespace(domain, system_prompt)
+        ts = self._ts.get(namespace)
+        if ts and ts[0] < (cutoff := self._cutoff()):
+            self._prune(namespace, cutoff)
+        vectors = self._vectors.get(namespace)
+        if not vectors:
+            return None
+        
+        matrix = self._matrices.get(namespace)
+        if matrix is None:
+            matrix = self._matrices[namespace] = np.vstack(vectors)
+        
+        if vector is None:
+            vector = self.embed([text])[0]
+        
+        # Эмбеддинги нормализованы: скалярное произведение = косинусная близость
+        scores = matrix @ vector
+        best = int(scores.argmax())
+        if scores[best] >= self.threshold:
+            logger.debug(f"Semantic cache hit ({scores[best]:.3f}) for augmentation: {text[:50]}...")
+            return self._results[namespace][best]
+        
+        return None
+    
+    def set_augmentation(self, text: str, domain: str, system_prompt: str, result: list, vector=None) -> None:
+        """Сохраняет результат аугментации вместе с эмбеддингом фразы (vector — готовый эмбеддинг text)"""
+        namespace = self._namespace(domain, system_prompt)
+        if vector is None:
+            vector = self.embed([text])[0]
+        ts = time.time()
+        self._append(namespace, vector, result, ts)
+        
+        entry = {"ns": namespace, "text": text, "vec": vector.tolist(), "result": result, "ts": ts}
+        try:
+            if self._file is None:
+                self._file = open(self.cache_file, "ab", buffering=CACHE_WRITE_BUFFER)
+            self._file.write(_jsonl_line(entry))
+            self._pending += 1
+            if self._pending >= CACHE_FLUSH_EVERY:
+                self.flush()
+        except Exception as e:
+            logger.warning(f"Failed to save semantic cache entry: {e}")
+    
+    def flush(self) -> None:
+        """Сбрасывает накопленные записи кэша на диск"""
+        if self._file is not None:
+            try:
+                self._file.flush()
+            except Exception as e:
+                logger.warning(f"Failed to flush semantic cache file: {e}")
+        self._pending = 0
+    
+    def close(self) -> None:
+        """Сбрасывает буфер и закрывает файл кэша"""
+        self.flush()
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+
 # Глобальный экземпляр кэша (будет инициализирован в bot.py)
 llm_cache: Optional[LLMCache] = None
+semantic_cache: Optional[SemanticCache] = None
 
 
 def get_cache() -> Optional[LLMCache]:
@@ -198,5 +428,27 @@ def get_cache() -> Optional[LLMCache]:
 def init_cache(cache_dir: Path, ttl_hours: int = 24) -> LLMCache:
     """Инициализирует глобальный кэш"""
     global llm_cache
+    if llm_cache is not None:
+        llm_cache.close()
     llm_cache = LLMCache(cache_dir, ttl_hours)
     return llm_cache
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """Возвращает глобальный семантический кэш (None, если не инициализирован)"""
+    return semantic_cache
+
+
+def init_semantic_cache(cache_dir: Path, threshold: float = 0.92,
+                        model_name: str = SemanticCache.DEFAULT_MODEL,
+                        ttl_hours: int = 24) -> Optional[SemanticCache]:
+    """Инициализирует глобальный семантический кэш; без sentence-transformers остается выключенным"""
+    global semantic_cache
+    if semantic_cache is not None:
+        semantic_cache.close()
+    try:
+        semantic_cache = SemanticCache(cache_dir, threshold, model_name, ttl_hours)
+    except ImportError as e:
+        logger.warning(f"Semantic cache disabled: {e}")
+        semantic_cache = None
+    return semantic_cache
@@ -7,7 +7,7 @@ ClickHouse Connector для загрузки логов ESK
 from __future__ import annotations
 
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, Tuple
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -83,77 +83,138 @@ class ClickHouseConnector:
             self.stats["errors"] += 1
             return False
     
+    def _build_query(
+        self,
+        *,
+        days: Optional[int] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        where_clause: Optional[str] = None,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Строит SQL запрос выгрузки логов и параметры для серверной подстановки.
+        Значения (дни, даты, лимит) передаются через {name:Type}, а не f-строкой.
+        """
+        
+        columns = [
+            f"{self.config.text_column} as text",
+            f"{self.config.timestamp_column} as ts",
+        ]
+        
+        if self.config.domain_column:
+            columns.append(f"{self.config.domain_column} as domain")
+        
+        if self.config.user_id_column:
+            columns.append(f"{self.config.user_id_column} as user_id")
+        
+        columns_str = ", ".join(columns)
+        
+        # WHERE условие по времени — ClickHouse сам переносит его в PREWHERE
+        # и отбрасывает гранулы по ключу партиционирования/сортировки
+        where_parts = []
+        parameters: Dict[str, Any] = {}
+        
+        if start_date is not None:
+            where_parts.append(f"{self.config.timestamp_column} >= {{start_date:Date}}")
+            parameters["start_date"] = start_date.date()
+        if end_date is not None:
+            where_parts.append(f"{self.config.timestamp_column} < {{end_date:Date}}")
+            parameters["end_date"] = end_date.date()
+        if days is not None:
+            where_parts.append(f"{self.config.timestamp_column} >= today() - {{days:UInt32}}")
+            parameters["days"] = days
+        
+        if where_clause:
+            where_parts.append(f"({where_clause})")
+        
+        where_str = f"WHERE {' AND '.join(where_parts)}" if where_parts else ""
+        
+        # LIMIT
+        limit_str = ""
+        if limit:
+            limit_str = "LIMIT {limit:UInt64}"
+            parameters["limit"] = limit
+        
+        query = f"""
+            SELECT {columns_str}
+            FROM {self.config.database}.{self.config.table_name}
+            {where_str}
+            ORDER BY {self.config.timestamp_column} DESC
+            {limit_str}
+        """
+        return query, parameters
+    
+    def iter_logs(
+        self,
+        *,
+        days: Optional[int] = 7,
+        limit: Optional[int] = None,
+        where_clause: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Выгружает логи потоком: DataFrame на каждый блок ответа ClickHouse.
+        Весь результат в памяти не держится — блоки можно сразу отдавать в ETL или писать в файл.
+        
+        Args:
+            days: количество дней для выгрузки (по умолчанию 7; None — без ограничения)
+            limit: максимум строк (опционально)
+            where_clause: дополнительное WHERE условие (опционально)
+            start_date, end_date: границы периода [start_date, end_date) (опционально)
+            
+        Yields:
+            DataFrame с очередным блоком логов
+        """
+        
+        if not self.client:
+            if not self.connect():
+                return
+        
+        query, parameters = self._build_query(
+            days=days, start_date=start_date, end_date=end_date,
+            limit=limit, where_clause=where_clause,
+        )
+        logger.info(f"Executing query: {query} parameters={parameters}")
+        
+        self.stats["total_queries"] += 1
+        with self.client.query_df_stream(query, parameters=parameters) as stream:
+            for df in stream:
+                self.stats["total_rows_fetched"] += len(df)
+                yield df
+    
     def fetch_logs(
         self,
         *,
-        days: int = 7,
+        days: Optional[int] = 7,
         limit: Optional[int] = None,
         where_clause: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
     ) -> pd.DataFrame:
         """
         Выгружает логи из ClickHouse.
         
         Args:
-            days: количество дней для выгрузки (по умолчанию 7)
+            days: количество дней для выгрузки (по умолчанию 7; None — без ограничения)
             limit: максимум строк (опционально)
             where_clause: дополнительное WHERE условие (опционально)
+            start_date, end_date: границы периода [start_date, end_date) (опционально)
             
         Returns:
             DataFrame с логами
         """
         
-        if not self.client:
-            if not self.connect():
-                return pd.DataFrame()
-        
         try:
-            # Строим SQL запрос
-            columns = [
-                f"{self.config.text_column} as text",
-                f"{self.config.timestamp_column} as ts",
-            ]
-            
-            if self.config.domain_column:
-                columns.append(f"{self.config.domain_column} as domain")
-            
-            if self.config.user_id_column:
-                columns.append(f"{self.config.user_id_column} as user_id")
-            
-            columns_str = ", ".join(columns)
-            
-            # WHERE условие
-            where_parts = [
-                f"{self.config.timestamp_column} >= today() - {days}"
-            ]
-            
-            if where_clause:
-                where_parts.append(where_clause)
-            
-            where_str = " AND ".join(where_parts)
-            
-            # LIMIT
-            limit_str = f"LIMIT {limit}" if limit else ""
-            
-            # Полный запрос
-            query = f"""
-                SELECT {columns_str}
-                FROM {self.config.database}.{self.config.table_name}
-                WHERE {where_str}
-                ORDER BY {self.config.timestamp_column} DESC
-                {limit_str}
-            """
-            
-            logger.info(f"Executing query: {query}")
-            
-            # Выполняем запрос
-            df = self.client.query_df(query)
+            chunks = list(self.iter_logs(
+                days=days, limit=limit, where_clause=where_clause,
+                start_date=start_date, end_date=end_date,
+            ))
+            df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
             
             logger.info(f"Fetched {len(df)} rows from ClickHouse")
             
-            # Статистика
-            self.stats["total_queries"] += 1
-            self.stats["total_rows_fetched"] += len(df)
-            
             return df
             
         except Exception as e:
@@ -179,13 +240,8 @@ class ClickHouseConnector:
             DataFrame с логами
         """
         
-        where_clause = (
-            f"{self.config.timestamp_column} >= '{start_date.strftime('%Y-%m-%d')}' "
-            f"AND {self.config.timestamp_column} < '{end_date.strftime('%Y-%m-%d')}'"
-        )
-        
-        # Вычисляем количество дней (для основного условия ставим 0)
-        return self.fetch_logs(days=0, limit=limit, where_clause=where_clause)
+        # Даты передаются параметрами; относительное условие по дням не добавляем
+        return self.fetch_logs(days=None, limit=limit, start_date=start_date, end_date=end_date)
     
     def export_to_file(
         self,
@@ -207,26 +263,84 @@ class ClickHouseConnector:
             True если успешно
         """
         
-        df = self.fetch_logs(days=days, limit=limit)
+        if format == "json":
+            # JSON-массив с отступами пишется только целиком
+            return self._export_json(output_path, days=days, limit=limit)
         
-        if df.empty:
-            logger.warning("No data to export")
+        if format not in ("csv", "jsonl", "parquet"):
+            logger.error(f"Failed to export: Unsupported format: {format}")
+            self.stats["errors"] += 1
             return False
         
         try:
             output_path.parent.mkdir(parents=True, exist_ok=True)
             
-            if format == "csv":
-                df.to_csv(output_path, index=False, encoding="utf-8")
-            elif format == "json":
-                df.to_json(output_path, orient="records", force_ascii=False, indent=2)
-            elif format == "jsonl":
-                df.to_json(output_path, orient="records", force_ascii=False, lines=True)
-            elif format == "parquet":
-                df.to_parquet(output_path, index=False)
+            if format == "parquet":
+                rows = self._export_parquet(output_path, days=days, limit=limit)
             else:
-                raise ValueError(f"Unsupported format: {format}")
+                # Блоки дописываются в файл по мере поступления
+                rows = 0
+                with open(output_path, "w", encoding="utf-8", newline="") as f:
+                    for df in self.iter_logs(days=days, limit=limit):
+                        if format == "csv":
+                            df.to_csv(f, index=False, header=(rows == 0))
+                        else:
+                            f.write(df.to_json(orient="records", force_ascii=False, lines=True).rstrip("\n") + "\n")
+                        rows += len(df)
+            
+            if rows == 0:
+                output_path.unlink(missing_ok=True)
+                logger.warning("No data to export")
+                return False
             
+            logger.info(f"Exported {rows} rows to {output_path}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to export: {e}")
+            self.stats["errors"] += 1
+            return False
+    
+    def _export_parquet(self, output_path: Path, *, days: int, limit: Optional[int]) -> int:
+        """Пишет Arrow-блоки ответа прямо в Parquet, не собирая таблицу целиком"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        if not self.client:
+            if not self.connect():
+                return 0
+        
+        query, parameters = self._build_query(days=days, limit=limit)
+        logger.info(f"Executing query: {query} parameters={parameters}")
+        self.stats["total_queries"] += 1
+        
+        rows = 0
+        writer = None
+        try:
+            with self.client.query_arrow_stream(query, parameters=parameters) as stream:
+                for batch in stream:
+                    table = batch if isinstance(batch, pa.Table) else pa.Table.from_batches([batch])
+                    if writer is None:
+                        writer = pq.ParquetWriter(output_path, table.schema)
+                    writer.write_table(table)
+                    rows += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        
+        self.stats["total_rows_fetched"] += rows
+        return rows
+    
+    def _export_json(self, output_path: Path, *, days: int, limit: Optional[int]) -> bool:
+        df = self.fetch_logs(days=days, limit=limit)
+        
+        if df.empty:
+            logger.warning("No data to export")
+            return False
+        
+        try:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            df.to_json(output_path, orient="records", force_ascii=False, indent=2)
             logger.info(f"Exported {len(df)} rows to {output_path}")
             return True
             
@@ -282,5 +396,4 @@ from src.pipeline import ETLProcessor
 
 etl = ETLProcessor()
 # df уже в нужном формате, можно передать в pipeline
-```
-
+"""
@@ -10,202 +10,222 @@
 
 from __future__ import annotations
 
+import dataclasses
 import os
+import typing
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
 from pathlib import Path
-from typing import Optional, Literal
-from pydantic import Field
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Any, Mapping, Optional, Literal
+
+from .env import load_env
 
 # Загружаем .env
-try:
-    from dotenv import load_dotenv, find_dotenv
-    _dotenv_path = find_dotenv(usecwd=True)
-    load_dotenv(_dotenv_path or ".env", override=False)
-except Exception:
-    pass
+load_env()
+
+
+_TRUE = {"1", "true", "t", "yes", "y", "on"}
+_FALSE = {"0", "false", "f", "no", "n", "off"}
+
+
+def _coerce(raw: str, tp: Any, name: str) -> Any:
+    """Приводит строку из окружения к типу поля (str/int/float/bool/Path, Optional, Literal)"""
+    origin = typing.get_origin(tp)
+    if origin is typing.Union:
+        args = [a for a in typing.get_args(tp) if a is not type(None)]
+        if not raw.strip():
+            return None
+        return _coerce(raw, args[0], name)
+    if origin is Literal:
+        if raw not in typing.get_args(tp):
+            raise ValueError(f"{name}: ожидается одно из {typing.get_args(tp)}, получено {raw!r}")
+        return raw
+    if tp is bool:
+        low = raw.strip().lower()
+        if low in _TRUE:
+            return True
+        if low in _FALSE:
+            return False
+        raise ValueError(f"{name}: не булево значение {raw!r}")
+    if tp in (int, float):
+        try:
+            return tp(raw.strip())
+        except ValueError:
+            raise ValueError(f"{name}: ожидается {tp.__name__}, получено {raw!r}") from None
+    if tp is Path:
+        return Path(raw)
+    return raw
+
+
+def _upper_env(environ: Mapping[str, str]) -> dict:
+    """
+    Окружение с именами переменных в верхнем регистре — как в pydantic-settings,
+    имена не зависят от регистра. При совпадении побеждает переменная, уже записанная заглавными.
+    """
+    env = {k.upper(): v for k, v in environ.items() if not k.isupper()}
+    env.update((k, v) for k, v in environ.items() if k.isupper())
+    return env
 
 
-class TelegramConfig(BaseSettings):
+def _load(cls: type, prefix: str, env: Mapping[str, str]) -> Any:
+    """
+    Заполняет dataclass-конфиг из окружения: поле foo_bar читается из
+    переменной {prefix}FOO_BAR, незаданные поля берут значение по умолчанию.
+    Имена в env ожидаются в верхнем регистре (см. _upper_env).
+    """
+    hints = typing.get_type_hints(cls)
+    values = {}
+    for f in dataclasses.fields(cls):
+        env_name = prefix + f.name.upper()
+        raw = env.get(env_name)
+        if raw is None:
+            if f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING:
+                raise ValueError(f"Не задана обязательная переменная окружения {env_name}")
+            continue
+        values[f.name] = _coerce(raw, hints[f.name], env_name)
+    return cls(**values)
+
+
+@dataclass(frozen=True, slots=True)
+class TelegramConfig:
     """Конфигурация Telegram бота"""
     
-    bot_token: str = Field(..., description="Токен Telegram бота")
-    public_url: Optional[str] = Field(None, description="Public URL для webhook")
-    port: int = Field(8080, description="Порт для webhook")
-    
-    model_config = SettingsConfigDict(
-        env_prefix="TELEGRAM_",
-        env_file=".env",
-        extra="ignore"
-    )
+    bot_token: str                      # Токен Telegram бота
+    public_url: Optional[str] = None    # Public URL для webhook
+    port: int = 8080                    # Порт для webhook
 
 
-class LLMConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class LLMConfig:
     """Конфигурация LLM"""
     
     # Основная модель
-    api_key: str = Field("", description="API ключ")
-    api_base: Optional[str] = Field(None, description="Базовый URL (для локальных моделей)")
-    model: str = Field("gpt-4o-mini", description="Название модели")
+    api_key: str = ""                   # API ключ
+    api_base: Optional[str] = None      # Базовый URL (для локальных моделей)
+    model: str = "gpt-4o-mini"          # Название модели
     
     # Ролевые модели (опционально)
-    labeler_api_key: Optional[str] = Field(None, description="API ключ для Labeler")
-    labeler_api_base: Optional[str] = Field(None, description="API base для Labeler")
-    labeler_model: Optional[str] = Field(None, description="Модель для Labeler")
+    labeler_api_key: Optional[str] = None
+    labeler_api_base: Optional[str] = None
+    labeler_model: Optional[str] = None
     
-    augmenter_api_key: Optional[str] = Field(None, description="API ключ для Augmenter")
-    augmenter_api_base: Optional[str] = Field(None, description="API base для Augmenter")
-    augmenter_model: Optional[str] = Field(None, description="Модель для Augmenter")
+    augmenter_api_key: Optional[str] = None
+    augmenter_api_base: Optional[str] = None
+    augmenter_model: Optional[str] = None
     
     # Параметры
-    temperature: float = Field(1.0, description="Temperature для генерации")
-    max_tokens: Optional[int] = Field(None, description="Максимум токенов")
-    
-    model_config = SettingsConfigDict(
-        env_prefix="LLM_",
-        env_file=".env",
-        extra="ignore"
-    )
+    temperature: float = 1.0            # Temperature для генерации
+    max_tokens: Optional[int] = None    # Максимум токенов
 
 
-class ETLConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class ETLConfig:
     """Конфигурация ETL процесса"""
     
-    max_rows: Optional[int] = Field(None, description="Максимум строк для обработки")
-    deduplicate: bool = Field(True, description="Удалять дубликаты")
-    min_text_length: int = Field(3, description="Минимальная длина текста")
-    max_text_length: int = Field(1000, description="Максимальная длина текста")
-    
-    model_config = SettingsConfigDict(
-        env_prefix="ETL_",
-        env_file=".env",
-        extra="ignore"
-    )
+    max_rows: Optional[int] = None      # Максимум строк для обработки
+    deduplicate: bool = True            # Удалять дубликаты
+    min_text_length: int = 3            # Минимальная длина текста
+    max_text_length: int = 1000         # Максимальная длина текста
 
 
-class LabelerConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class LabelerConfig:
     """Конфигурация Labeler агента"""
     
-    batch_size: int = Field(20, description="Размер батча")
-    rate_limit: float = Field(0.4, description="Задержка между запросами (сек)")
-    low_conf_threshold: float = Field(0.5, description="Порог низкой уверенности")
+    batch_size: int = 20                # Размер батча
+    rate_limit: float = 0.4             # Задержка между запросами (сек)
+    low_conf_threshold: float = 0.5     # Порог низкой уверенности
     
-    use_cache: bool = Field(True, description="Использовать кэш")
-    use_dynamic_fewshot: bool = Field(True, description="Использовать динамические примеры")
-    
-    model_config = SettingsConfigDict(
-        env_prefix="LABELER_",
-        env_file=".env",
-        extra="ignore"
-    )
+    use_cache: bool = True              # Использовать кэш
+    use_dynamic_fewshot: bool = True    # Использовать динамические примеры
 
 
-class AugmenterConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class AugmenterConfig:
     """Конфигурация Augmenter агента"""
     
-    variants_per_sample: int = Field(3, description="Вариантов на образец")
-    include_hard_negatives: bool = Field(False, description="Включать пограничные случаи")
-    
-    concurrency: int = Field(8, description="Конкурентность")
-    rate_limit: float = Field(0.1, description="Задержка между запросами (сек)")
-    max_samples_per_domain: int = Field(30, description="Максимум образцов на домен")
+    variants_per_sample: int = 3        # Вариантов на образец
+    include_hard_negatives: bool = False  # Включать пограничные случаи
     
-    use_cache: bool = Field(True, description="Использовать кэш")
+    concurrency: int = 8                # Конкурентность
+    rate_limit: float = 0.1             # Задержка между запросами (сек)
+    max_samples_per_domain: int = 30    # Максимум образцов на домен
     
-    model_config = SettingsConfigDict(
-        env_prefix="AUGMENTER_",
-        env_file=".env",
-        extra="ignore"
-    )
+    use_cache: bool = True              # Использовать кэш
 
 
-class ReviewConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class ReviewConfig:
     """Конфигурация ReviewDataset (HITL)"""
     
-    low_confidence_threshold: float = Field(0.5, description="Порог низкой уверенности")
-    high_priority_threshold: float = Field(0.3, description="Порог высокого приоритета")
-    max_queue_size: int = Field(10000, description="Максимальный размер очереди")
-    auto_approve_threshold: float = Field(0.95, description="Порог автоодобрения")
-    
-    model_config = SettingsConfigDict(
-        env_prefix="REVIEW_",
-        env_file=".env",
-        extra="ignore"
-    )
+    low_confidence_threshold: float = 0.5   # Порог низкой уверенности
+    high_priority_threshold: float = 0.3    # Порог высокого приоритета
+    max_queue_size: int = 10000             # Максимальный размер очереди
+    auto_approve_threshold: float = 0.95    # Порог автоодобрения
 
 
-class DataWriterConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class DataWriterConfig:
     """Конфигурация DataWriter"""
     
-    eval_fraction: float = Field(0.1, description="Доля eval датасета")
-    min_eval_samples: int = Field(50, description="Минимум образцов в eval")
-    min_samples_per_domain: int = Field(5, description="Минимум образцов на домен")
-    
-    balance_domains: bool = Field(True, description="Балансировать домены")
-    max_samples_per_domain: Optional[int] = Field(None, description="Максимум образцов на домен")
+    eval_fraction: float = 0.1          # Доля eval датасета
+    min_eval_samples: int = 50          # Минимум образцов в eval
+    min_samples_per_domain: int = 5     # Минимум образцов на домен
     
-    shard_size: Optional[int] = Field(None, description="Размер шарда")
+    balance_domains: bool = True        # Балансировать домены
+    max_samples_per_domain: Optional[int] = None  # Максимум образцов на домен
     
-    include_metadata: bool = Field(True, description="Включать метаданные")
-    validate_quality: bool = Field(True, description="Валидировать качество")
+    shard_size: Optional[int] = None    # Размер шарда
     
-    model_config = SettingsConfigDict(
-        env_prefix="DATA_WRITER_",
-        env_file=".env",
-        extra="ignore"
-    )
+    include_metadata: bool = True       # Включать метаданные
+    validate_quality: bool = True       # Валидировать качество
 
 
-class DataStorageConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class DataStorageConfig:
     """Конфигурация DataStorage"""
     
-    enable_compression: bool = Field(False, description="Сжимать датасеты")
-    max_versions: int = Field(100, description="Максимум версий")
-    auto_archive_old: bool = Field(True, description="Автоархивирование старых версий")
-    
-    model_config = SettingsConfigDict(
-        env_prefix="DATA_STORAGE_",
-        env_file=".env",
-        extra="ignore"
-    )
+    enable_compression: bool = False    # Сжимать датасеты
+    max_versions: int = 100             # Максимум версий
+    auto_archive_old: bool = True       # Автоархивирование старых версий
 
 
-class CacheConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class CacheConfig:
     """Конфигурация кэша"""
     
-    ttl_hours: int = Field(24, description="TTL кэша в часах")
-    enabled: bool = Field(True, description="Включить кэш")
+    ttl_hours: int = 24                 # TTL кэша в часах
+    enabled: bool = True                # Включить кэш
     
-    model_config = SettingsConfigDict(
-        env_prefix="CACHE_",
-        env_file=".env",
-        extra="ignore"
-    )
+    # Семантический кэш аугментаций (нужен sentence-transformers)
+    semantic_enabled: bool = False      # Включить семантический кэш аугментаций
+    semantic_threshold: float = 0.92    # Порог косинусной близости для попадания
+    semantic_model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    
+    def __post_init__(self):
+        if not 0.0 <= self.semantic_threshold <= 1.0:
+            raise ValueError("CACHE_SEMANTIC_THRESHOLD должен быть в диапазоне [0, 1]")
 
 
-class AppConfig(BaseSettings):
+@dataclass(frozen=True, slots=True)
+class AppConfig:
     """Общая конфигурация приложения"""
     
     # Режим работы
-    mode: Literal["development", "production"] = Field("development", description="Режим работы")
+    mode: Literal["development", "production"] = "development"
     
     # Директории
-    data_dir: Path = Field(Path("data"), description="Директория для данных")
-    prompts_dir: Path = Field(Path("prompts"), description="Директория с промптами")
+    data_dir: Path = Path("data")       # Директория для данных
+    prompts_dir: Path = Path("prompts")  # Директория с промптами
     
     # Логирование
-    log_level: str = Field("INFO", description="Уровень логирования")
-    log_to_file: bool = Field(False, description="Логировать в файл")
-    log_file: Optional[Path] = Field(None, description="Путь к лог файлу")
+    log_level: str = "INFO"             # Уровень логирования
+    log_to_file: bool = False           # Логировать в файл
+    log_file: Optional[Path] = None     # Путь к лог файлу
     
     # Прогресс
-    progress_chunk: int = Field(100, description="Чанк для прогресса")
-    send_partials: bool = Field(True, description="Отправлять промежуточные результаты")
-    
-    model_config = SettingsConfigDict(
-        env_prefix="APP_",
-        env_file=".env",
-        extra="ignore"
-    )
+    progress_chunk: int = 100           # Чанк для прогресса
+    send_partials: bool = True          # Отправлять промежуточные результаты
 
 
 class Settings:
@@ -215,21 +235,37 @@ class Settings:
     Объединяет все конфигурации компонентов.
     """
     
+    # Секции создаются лениво, при первом обращении: атрибут -> (класс, префикс переменных)
+    _SECTIONS = {
+        "app": (AppConfig, "APP_"),
+        "telegram": (TelegramConfig, "TELEGRAM_"),
+        "llm": (LLMConfig, "LLM_"),
+        "etl": (ETLConfig, "ETL_"),
+        "labeler": (LabelerConfig, "LABELER_"),
+        "augmenter": (AugmenterConfig, "AUGMENTER_"),
+        "review": (ReviewConfig, "REVIEW_"),
+        "data_writer": (DataWriterConfig, "DATA_WRITER_"),
+        "data_storage": (DataStorageConfig, "DATA_STORAGE_"),
+        "cache": (CacheConfig, "CACHE_"),
+    }
+    
     def __init__(self):
-        self.app = AppConfig()
-        self.telegram = TelegramConfig()
-        self.llm = LLMConfig()
-        self.etl = ETLConfig()
-        self.labeler = LabelerConfig()
-        self.augmenter = AugmenterConfig()
-        self.review = ReviewConfig()
-        self.data_writer = DataWriterConfig()
-        self.data_storage = DataStorageConfig()
-        self.cache = CacheConfig()
+        # Один снимок окружения на все секции (имена переменных без учета регистра)
+        self._env = _upper_env(os.environ)
         
         # Создаем директории
         self._setup_directories()
     
+    def __getattr__(self, name: str) -> Any:
+        # Вызывается только для ещё не созданных атрибутов
+        section = type(self)._SECTIONS.get(name)
+        if section is None:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        cls, prefix = section
+        obj = _load(cls, prefix, self.__dict__["_env"])
+        self.__dict__[name] = obj
+        return obj
+    
     def _setup_directories(self):
         """Создает необходимые директории"""
         self.app.data_dir.mkdir(parents=True, exist_ok=True)
@@ -239,26 +275,41 @@ class Settings:
         (self.app.data_dir / "storage" / "versions").mkdir(parents=True, exist_ok=True)
     
     @classmethod
+    @lru_cache(maxsize=1)
     def load(cls) -> "Settings":
-        """Загружает настройки из переменных окружения"""
+        """
+        Загружает настройки из переменных окружения.
+        Кэшируется на процесс: повторные вызовы не перечитывают окружение
+        и не создают директории заново (сброс — Settings.load.cache_clear()).
+        """
         return cls()
     
-    def get_labeler_llm_config(self) -> dict:
-        """Возвращает конфиг LLM для Labeler"""
+    @cached_property
+    def labeler_llm_config(self) -> dict:
+        """Конфиг LLM для Labeler (собирается один раз)"""
         return {
             "api_key": self.llm.labeler_api_key or self.llm.api_key,
             "api_base": self.llm.labeler_api_base or self.llm.api_base,
             "model": self.llm.labeler_model or self.llm.model,
         }
     
-    def get_augmenter_llm_config(self) -> dict:
-        """Возвращает конфиг LLM для Augmenter"""
+    @cached_property
+    def augmenter_llm_config(self) -> dict:
+        """Конфиг LLM для Augmenter (собирается один раз)"""
         return {
             "api_key": self.llm.augmenter_api_key or self.llm.api_key,
             "api_base": self.llm.augmenter_api_base or self.llm.api_base,
             "model": self.llm.augmenter_model or self.llm.model,
         }
     
+    def get_labeler_llm_config(self) -> dict:
+        """Возвращает конфиг LLM для Labeler"""
+        return dict(self.labeler_llm_config)
+    
+    def get_augmenter_llm_config(self) -> dict:
+        """Возвращает конфиг LLM для Augmenter"""
+        return dict(self.augmenter_llm_config)
+    
     def is_production(self) -> bool:
         """Проверяет, запущено ли приложение в production режиме"""
         return self.app.mode == "production"
@@ -1,14 +1,76 @@
 from __future__ import annotations
 
+import atexit
+import heapq
 import json
 import logging
+import os
+import time
+from collections import Counter
+from operator import itemgetter
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import BinaryIO, Dict, List, Any, Optional
 from datetime import datetime, timedelta
-from collections import deque
+
+try:
+    import orjson  # быстрая сериализация JSONL; если не установлен — stdlib json
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Снимки контекстов копятся в буфере открытого файла и сбрасываются на диск пачками
+CONTEXT_WRITE_BUFFER = 1 << 16
+CONTEXT_FLUSH_EVERY = 20
+# Файл переписывается только живыми контекстами, если в нём во столько раз больше записей
+CONTEXT_COMPACT_RATIO = 2
+
+
+def _jsonl_line(entry: Dict[str, Any]) -> bytes:
+    """Строка JSONL в UTF-8: orjson, если установлен, иначе stdlib json"""
+    if orjson is not None:
+        return orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@dataclass(slots=True)
+class Message:
+    """Сообщение в истории пользователя (ts — epoch-секунды, в ISO только при сериализации)"""
+    
+    ts: float
+    text: str
+    predicted_domain: str
+    corrected_domain: str
+    confidence: float
+    was_corrected: bool
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "timestamp": datetime.fromtimestamp(self.ts).isoformat(),
+            "text": self.text,
+            "predicted_domain": self.predicted_domain,
+            "corrected_domain": self.corrected_domain,
+            "confidence": self.confidence,
+            "was_corrected": self.was_corrected,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Message":
+        try:
+            ts = datetime.fromisoformat(data["timestamp"]).timestamp()
+        except (ValueError, KeyError, TypeError):
+            ts = time.time()
+        predicted = data.get("predicted_domain", "")
+        return cls(
+            ts=ts,
+            text=data.get("text", ""),
+            predicted_domain=predicted,
+            corrected_domain=data.get("corrected_domain") or predicted,
+            confidence=float(data.get("confidence", 0.0)),
+            was_corrected=bool(data.get("was_corrected", False)),
+        )
+
 
 class UserContext:
     """
@@ -18,84 +80,126 @@ class UserContext:
     def __init__(self, user_id: str, max_history: int = 10):
         self.user_id = user_id
         self.max_history = max_history
-        self.message_history: deque = deque(maxlen=max_history)
-        self.domain_preferences: Dict[str, float] = {}
+        # Кольцевой буфер истории: _head — куда писать следующее сообщение
+        self._history: List[Optional[Message]] = [None] * max(0, max_history)
+        self._head = 0
+        self._count = 0
+        # Сырые счётчики доменов; нормированные доли считаются только по запросу
+        self.domain_counts: Dict[str, float] = {}
+        self._total = 0.0
         self.last_activity = datetime.now()
         
+        # Версия контекста растёт с каждым сообщением; по ней кэшируется системный промпт
+        self.version = 0
+        self._prompt_cache: Optional[tuple] = None  # (version, base, prompt)
+        
     def add_message(self, text: str, predicted_domain: str, 
                    corrected_domain: Optional[str] = None, confidence: float = 0.0) -> None:
         """Добавляет сообщение в историю пользователя"""
         
-        message_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "text": text,
-            "predicted_domain": predicted_domain,
-            "corrected_domain": corrected_domain or predicted_domain,
-            "confidence": confidence,
-            "was_corrected": corrected_domain is not None and corrected_domain != predicted_domain
-        }
-        
-        self.message_history.append(message_entry)
+        self._append(Message(
+            ts=time.time(),
+            text=text,
+            predicted_domain=predicted_domain,
+            corrected_domain=corrected_domain or predicted_domain,
+            confidence=confidence,
+            was_corrected=corrected_domain is not None and corrected_domain != predicted_domain,
+        ))
         self.last_activity = datetime.now()
+        self.version += 1
         
         # Обновляем предпочтения доменов
         final_domain = corrected_domain or predicted_domain
-        if final_domain in self.domain_preferences:
-            self.domain_preferences[final_domain] += 1.0
-        else:
-            self.domain_preferences[final_domain] = 1.0
-            
-        # Нормализуем предпочтения
-        total = sum(self.domain_preferences.values())
-        if total > 0:
-            for domain in self.domain_preferences:
-                self.domain_preferences[domain] /= total
+        self.domain_counts[final_domain] = self.domain_counts.get(final_domain, 0.0) + 1.0
+        self._total += 1.0
+    
+    def _append(self, message: Message) -> None:
+        if not self._history:
+            return
+        self._history[self._head] = message
+        self._head = (self._head + 1) % len(self._history)
+        self._count = min(self._count + 1, len(self._history))
+    
+    def recent_messages(self, n: Optional[int] = None) -> List[Message]:
+        """Последние n сообщений (все, если n не задан) в хронологическом порядке"""
+        size = len(self._history)
+        count = self._count if n is None else max(0, min(n, self._count))
+        return [self._history[(self._head - count + i) % size] for i in range(count)]
+    
+    @property
+    def message_history(self) -> List[Message]:
+        """История сообщений, от старых к новым"""
+        return self.recent_messages()
+    
+    @property
+    def message_count(self) -> int:
+        return self._count
+    
+    @property
+    def domain_preferences(self) -> Dict[str, float]:
+        """Доли доменов в истории пользователя (сумма = 1)"""
+        if not self._total:
+            return {}
+        return {domain: count / self._total for domain, count in self.domain_counts.items()}
     
     def get_context_for_classification(self) -> str:
         """Возвращает контекст для улучшения классификации"""
         
-        if not self.message_history:
+        if not self._count:
             return ""
         
         # Последние 3 сообщения для контекста
-        recent_messages = list(self.message_history)[-3:]
+        recent_messages = self.recent_messages(3)
         
         context_parts = ["КОНТЕКСТ ПОЛЬЗОВАТЕЛЯ:"]
         
         # История сообщений
         for i, msg in enumerate(recent_messages[:-1]):  # Исключаем текущее сообщение
             context_parts.append(
-                f"Сообщение {i+1}: \"{msg['text'][:100]}\" → {msg['corrected_domain']}"
+                f"Сообщение {i+1}: \"{msg.text[:100]}\" → {msg.corrected_domain}"
             )
         
         # Предпочтения доменов
-        if self.domain_preferences:
-            top_domains = sorted(self.domain_preferences.items(), 
-                               key=lambda x: x[1], reverse=True)[:3]
+        if self.domain_counts:
+            top_domains = heapq.nlargest(3, self.domain_counts.items(), key=itemgetter(1))
             context_parts.append("Частые домены пользователя: " + 
-                               ", ".join(f"{domain} ({prob:.1%})" for domain, prob in top_domains))
+                               ", ".join(f"{domain} ({count / self._total:.1%})" for domain, count in top_domains))
         
         return "\n".join(context_parts) + "\n"
     
+    def get_enhanced_system_prompt(self, base: str) -> str:
+        """
+        Системный промпт с контекстом пользователя. Собирается один раз на версию
+        контекста: между сообщениями возвращается тот же объект строки.
+        """
+        cached = self._prompt_cache
+        if cached is not None and cached[0] == self.version and cached[1] == base:
+            return cached[2]
+        
+        user_context = self.get_context_for_classification()
+        prompt = f"{base}\n\n{user_context}" if user_context else base
+        self._prompt_cache = (self.version, base, prompt)
+        return prompt
+    
     def get_preferred_domains(self, top_k: int = 5) -> List[str]:
         """Возвращает предпочтительные домены для пользователя"""
         
-        if not self.domain_preferences:
+        if not self.domain_counts:
             return []
             
-        sorted_domains = sorted(self.domain_preferences.items(), 
-                              key=lambda x: x[1], reverse=True)
-        return [domain for domain, _ in sorted_domains[:top_k]]
+        top_domains = heapq.nlargest(top_k, self.domain_counts.items(), key=itemgetter(1))
+        return [domain for domain, _ in top_domains]
     
-    def is_active(self, hours: int = 24) -> bool:
-        """Проверяет, активен ли пользователь в последние N часов"""
-        return datetime.now() - self.last_activity < timedelta(hours=hours)
+    def is_active(self, hours: int = 24, *, now: Optional[datetime] = None) -> bool:
+        """Проверяет, активен ли пользователь в последние N часов (now — общий момент для пачки проверок)"""
+        return (now or datetime.now()) - self.last_activity < timedelta(hours=hours)
     
     def to_dict(self) -> Dict[str, Any]:
         """Сериализует контекст в словарь"""
         return {
             "user_id": self.user_id,
-            "message_history": list(self.message_history),
+            "message_history": [msg.to_dict() for msg in self.recent_messages()],
+            "domain_counts": self.domain_counts,
             "domain_preferences": self.domain_preferences,
             "last_activity": self.last_activity.isoformat()
         }
@@ -107,9 +211,15 @@ class UserContext:
         
         # Восстанавливаем историю
         for msg in data.get("message_history", []):
-            context.message_history.append(msg)
+            context._append(Message.from_dict(msg))
         
-        context.domain_preferences = data.get("domain_preferences", {})
+        counts = data.get("domain_counts")
+        if counts is None:
+            # Старый формат хранил только доли: восстанавливаем счётчики в масштабе истории
+            scale = max(1, context.message_count)
+            counts = {d: p * scale for d, p in data.get("domain_preferences", {}).items()}
+        context.domain_counts = dict(counts)
+        context._total = float(sum(context.domain_counts.values()))
         
         try:
             context.last_activity = datetime.fromisoformat(data["last_activity"])
@@ -129,11 +239,17 @@ class ContextManager:
         self.contexts_file = data_dir / "user_contexts.jsonl"
         self.contexts: Dict[str, UserContext] = {}
         
+        # Файл контекстов, открытый на дозапись, и число записей с последнего flush
+        self._file: Optional[BinaryIO] = None
+        self._pending = 0
+        
         # Создаем директорию если нет
         self.data_dir.mkdir(parents=True, exist_ok=True)
         
         # Загружаем существующие контексты
         self._load_contexts()
+        
+        atexit.register(self.close)
     
     def _load_contexts(self) -> None:
         """Загружает контексты из файла"""
@@ -141,34 +257,82 @@ class ContextManager:
         if not self.contexts_file.exists():
             return
         
+        loads = orjson.loads if orjson is not None else json.loads
+        cutoff = datetime.now() - timedelta(hours=24 * 7)
+        records = 0
         try:
-            with open(self.contexts_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        data = json.loads(line.strip())
-                        context = UserContext.from_dict(data)
-                        
-                        # Загружаем только активные контексты (последние 7 дней)
-                        if context.is_active(hours=24 * 7):
-                            self.contexts[context.user_id] = context
-                            
-                    except json.JSONDecodeError:
-                        continue
+            for line in self.contexts_file.read_bytes().splitlines():
+                if not line.strip():
+                    continue
+                records += 1
+                try:
+                    data = loads(line)
+                    context = UserContext.from_dict(data)
+                    
+                    # Загружаем только активные контексты (последние 7 дней)
+                    if context.last_activity > cutoff:
+                        self.contexts[context.user_id] = context
                         
+                except ValueError:
+                    continue
+                    
             logger.info(f"Loaded {len(self.contexts)} user contexts")
             
         except Exception as e:
             logger.warning(f"Failed to load user contexts: {e}")
+            return
+        
+        # Каждое обновление дописывает полный снимок: без компактации старт читает всю историю записей
+        if records > CONTEXT_COMPACT_RATIO * max(1, len(self.contexts)):
+            self._compact()
+    
+    def _compact(self) -> None:
+        """Переписывает файл контекстов: по одной записи на загруженный контекст"""
+        
+        self.close()
+        tmp_path = self.contexts_file.with_name(self.contexts_file.name + ".tmp")
+        try:
+            with open(tmp_path, "wb", buffering=CONTEXT_WRITE_BUFFER) as f:
+                for context in self.contexts.values():
+                    f.write(_jsonl_line(context.to_dict()))
+            os.replace(tmp_path, self.contexts_file)
+            logger.info(f"Compacted user contexts file to {len(self.contexts)} records")
+        except Exception as e:
+            logger.warning(f"Failed to compact user contexts: {e}")
+            tmp_path.unlink(missing_ok=True)
     
     def _save_context(self, context: UserContext) -> None:
         """Сохраняет контекст в файл"""
         
         try:
-            with open(self.contexts_file, "a", encoding="utf-8") as f:
-                f.write(json.dumps(context.to_dict(), ensure_ascii=False) + "\n")
+            if self._file is None:
+                self._file = open(self.contexts_file, "ab", buffering=CONTEXT_WRITE_BUFFER)
+            self._file.write(_jsonl_line(context.to_dict()))
+            self._pending += 1
+            if self._pending >= CONTEXT_FLUSH_EVERY:
+                self.flush()
         except Exception as e:
             logger.warning(f"Failed to save context for user {context.user_id}: {e}")
     
+    def flush(self) -> None:
+        """Сбрасывает накопленные снимки контекстов на диск"""
+        if self._file is not None:
+            try:
+                self._file.flush()
+            except Exception as e:
+                logger.warning(f"Failed to flush user contexts: {e}")
+        self._pending = 0
+    
+    def close(self) -> None:
+        """Сбрасывает буфер и закрывает файл контекстов"""
+        self.flush()
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+    
     def get_context(self, user_id: str) -> UserContext:
         """Получает или создает контекст пользователя"""
         
@@ -195,6 +359,14 @@ class ContextManager:
         
         return self.contexts[user_id].get_context_for_classification()
     
+    def get_enhanced_system_prompt(self, user_id: str, base: str) -> str:
+        """Системный промпт с контекстом пользователя (кэшируется до следующего сообщения)"""
+        
+        if user_id not in self.contexts:
+            return base
+        
+        return self.contexts[user_id].get_enhanced_system_prompt(base)
+    
     def get_preferred_domains(self, user_id: str, top_k: int = 5) -> List[str]:
         """Получает предпочтительные домены пользователя"""
         
@@ -206,14 +378,18 @@ class ContextManager:
     def cleanup_inactive_contexts(self, hours: int = 24 * 7) -> int:
         """Очищает неактивные контексты"""
         
-        inactive_users = []
-        for user_id, context in self.contexts.items():
-            if not context.is_active(hours):
-                inactive_users.append(user_id)
+        cutoff = datetime.now() - timedelta(hours=hours)
+        inactive_users = [
+            user_id for user_id, context in self.contexts.items()
+            if context.last_activity <= cutoff
+        ]
         
         for user_id in inactive_users:
             del self.contexts[user_id]
         
+        if inactive_users:
+            self._compact()
+        
         logger.info(f"Cleaned up {len(inactive_users)} inactive user contexts")
         return len(inactive_users)
     
@@ -223,16 +399,16 @@ class ContextManager:
         if not self.contexts:
             return {"total_users": 0, "active_users": 0, "total_messages": 0}
         
-        active_users = sum(1 for ctx in self.contexts.values() if ctx.is_active(hours=24))
-        total_messages = sum(len(ctx.message_history) for ctx in self.contexts.values())
+        cutoff = datetime.now() - timedelta(hours=24)
+        active_users = sum(1 for ctx in self.contexts.values() if ctx.last_activity > cutoff)
+        total_messages = sum(ctx.message_count for ctx in self.contexts.values())
         
-        # Топ доменов по всем пользователям
-        all_preferences = {}
+        # Топ доменов по всем пользователям: сумма долей, каждый пользователь весит одинаково
+        all_preferences: Counter = Counter()
         for ctx in self.contexts.values():
-            for domain, count in ctx.domain_preferences.items():
-                all_preferences[domain] = all_preferences.get(domain, 0) + count
+            all_preferences.update(ctx.domain_preferences)
         
-        top_domains = sorted(all_preferences.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_domains = all_preferences.most_common(5)
         
         return {
             "total_users": len(self.contexts),
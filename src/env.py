@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+# Общая загрузка .env для config.py и config_v2.py: файл ищется и разбирается один раз на процесс
+
+_loaded = False
+
+
+def load_env() -> None:
+    """Грузит .env из текущей папки проекта (или ближайшей вверх по дереву); повторные вызовы — no-op"""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    try:
+        from dotenv import load_dotenv, find_dotenv  # python-dotenv
+        _dotenv_path = find_dotenv(usecwd=True)
+        load_dotenv(_dotenv_path or ".env", override=False)
+    except Exception:
+        # если python-dotenv не установлен — просто пропускаем (переменные могут быть заданы в системе)
+        pass
@@ -1,13 +1,31 @@
 # src/etl.py
 from __future__ import annotations
 
+import codecs
 import io
 import re
+from datetime import datetime
 from pathlib import Path
 from typing import Iterable, Optional
 
 import pandas as pd
 
+try:
+    import python_calamine  # noqa: F401  # Rust-парсер xlsx/xls для pandas (engine="calamine")
+    EXCEL_ENGINE: Optional[str] = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None  # pandas выберет openpyxl/xlrd сам
+
+try:
+    import pyarrow.csv as pa_csv  # многопоточный C++ парсер CSV; без него — pandas C-engine
+except ImportError:
+    pa_csv = None
+
+try:
+    import polars as pl  # быстрый Rust-писатель parquet; без него — pandas to_parquet
+except ImportError:
+    pl = None
+
 # -------- helpers --------
 
 _CANDIDATE_TEXT_COLS = [
@@ -15,6 +33,15 @@ _CANDIDATE_TEXT_COLS = [
     "user_text", "question", "content", "msg",
 ]
 
+_CSV_SEPARATORS = (",", ";", "\t", "|")
+_CSV_SNIFF_BYTES = 8192
+_ENCODING_PROBE_BYTES = 1 << 16
+_WS_RE = re.compile(r"\s+")
+# Пробельные символы, которые _WS_RE меняет: всё, кроме одиночного пробела
+_WS_DIRTY_RE = re.compile(r"[^\S ]| {2}")
+# С какого размера таблицы CSV-копия logs_norm не пишется (parquet уже есть)
+CSV_MIRROR_MAX_ROWS = 100_000
+
 _TS_COLS = ["ts", "timestamp", "time", "created_at", "datetime", "date"]
 _USER_COLS = ["user_id", "uid", "client_id", "cid"]
 
@@ -22,32 +49,69 @@ _USER_COLS = ["user_id", "uid", "client_id", "cid"]
 def _detect_encoding_bytes(b: bytes) -> str:
     """
     Пытаемся читать в UTF-8, если падает — пробуем cp1251.
-    Без внешних либ вроде chardet.
+    Без внешних либ вроде chardet. Смотрим на BOM и первые _ENCODING_PROBE_BYTES,
+    а не декодируем весь файл под каждую кодировку.
     """
-    for enc in ("utf-8-sig", "utf-8", "cp1251"):
+    if b.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    probe = b[:_ENCODING_PROBE_BYTES]
+    try:
+        probe.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # префикс разрезал многобайтный символ на границе — это всё ещё UTF-8
+        if len(b) > len(probe) and e.start >= len(probe) - 3 and e.reason == "unexpected end of data":
+            return "utf-8"
+    try:
+        probe.decode("cp1251")
+        return "cp1251"
+    except UnicodeDecodeError:
+        return "utf-8"
+
+
+def _sniff_sep(raw: bytes) -> str:
+    """Разделитель по заголовку: самый частый из _CSV_SEPARATORS в первой строке"""
+    header = raw[:_CSV_SNIFF_BYTES].split(b"\n", 1)[0]
+    counts = {sep: header.count(sep.encode()) for sep in _CSV_SEPARATORS}
+    best = max(_CSV_SEPARATORS, key=counts.__getitem__)
+    return best if counts[best] else ","
+
+
+def _read_csv_bytes(raw: bytes, enc: str | None = None) -> pd.DataFrame:
+    enc = enc or _detect_encoding_bytes(raw)
+    sep = _sniff_sep(raw)
+    # один проход парсера с заранее известным разделителем
+    if pa_csv is not None:
         try:
-            b.decode(enc)
-            return enc
+            table = pa_csv.read_csv(
+                io.BytesIO(raw),
+                read_options=pa_csv.ReadOptions(encoding=enc),
+                parse_options=pa_csv.ParseOptions(delimiter=sep, newlines_in_values=True),
+            )
+            return table.to_pandas()
         except Exception:
-            continue
-    return "utf-8"
+            pass  # нестрогий CSV (рваные строки и т.п.) — пусть разбирает pandas
+    try:
+        try:
+            return pd.read_csv(io.BytesIO(raw), encoding=enc, sep=sep)
+        except UnicodeDecodeError:
+            raise
+        except Exception:
+            # последний шанс: пусть pandas сам угадает
+            return pd.read_csv(io.BytesIO(raw), encoding=enc, sep=None, engine="python")
+    except UnicodeDecodeError:
+        # кодировка определялась по началу файла: ASCII-префикс дает utf-8, а дальше может быть cp1251
+        if enc == "cp1251":
+            raise
+        return _read_csv_bytes(raw, "cp1251")
 
 
 def _read_any_table(path: Path) -> pd.DataFrame:
     suf = path.suffix.lower()
     if suf in (".xlsx", ".xls"):
-        return pd.read_excel(path)
+        return pd.read_excel(path, engine=EXCEL_ENGINE)
     if suf in (".csv",):
-        raw = path.read_bytes()
-        enc = _detect_encoding_bytes(raw)
-        # авто-разделитель: сначала запятая, потом ; таб
-        for sep in (",", ";", "\t", "|"):
-            try:
-                return pd.read_csv(io.BytesIO(raw), encoding=enc, sep=sep)
-            except Exception:
-                continue
-        # последний шанс: пусть pandas сам угадает
-        return pd.read_csv(io.BytesIO(raw), encoding=enc, engine="python")
+        return _read_csv_bytes(path.read_bytes())
     raise ValueError(f"Unsupported file type: {suf}")
 
 
@@ -64,19 +128,39 @@ def _pick_text_column(df: pd.DataFrame) -> Optional[str]:
     if col:
         return col
     # fallback: берём первый object/строковый столбец с “длинными” строками
-    for c in df.columns:
-        if pd.api.types.is_object_dtype(df[c]):
-            try:
-                sample = df[c].dropna().astype(str).head(50)
-                if not sample.empty and sample.str.len().mean() >= 5:
-                    return c
-            except Exception:
-                continue
+    for c in df.select_dtypes(include=["object", "string"]).columns:
+        try:
+            col = df[c]
+            # обычно первых 50 строк хватает; dropna по всему столбцу — только если они пустые
+            sample = col.head(50).dropna()
+            if sample.empty:
+                sample = col.dropna().head(50)
+            if not sample.empty and sample.astype(str).str.len().mean() >= 5:
+                return c
+        except Exception:
+            continue
     return None
 
 
 # -------- public API --------
 
+def _parse_ts(col: pd.Series) -> pd.Series:
+    """
+    Метки времени в UTC. ISO-строки разбираются C-парсером с format="ISO8601"
+    (формат определяется по первому непустому значению), остальное — общим разбором.
+    """
+    if not pd.api.types.is_object_dtype(col) and not pd.api.types.is_string_dtype(col):
+        return pd.to_datetime(col, errors="coerce", utc=True)
+    first = col.first_valid_index()
+    if first is not None:
+        try:
+            datetime.fromisoformat(str(col[first]).strip())
+            return pd.to_datetime(col, format="ISO8601", errors="coerce", utc=True, cache=True)
+        except ValueError:
+            pass
+    return pd.to_datetime(col, errors="coerce", utc=True, cache=True)
+
+
 def normalize_file_to_df(path: Path, *, max_rows: int | None = None) -> pd.DataFrame:
     """
     Универсальная загрузка: .xlsx и .csv → нормализованный DF с колонкой `text`.
@@ -85,7 +169,7 @@ def normalize_file_to_df(path: Path, *, max_rows: int | None = None) -> pd.DataF
     df = _read_any_table(path)
 
     # нормализуем имена колонок
-    df.columns = [str(c).strip().lower() for c in df.columns]
+    df.columns = df.columns.astype(str).str.strip().str.lower()
 
     # текст
     text_col = _pick_text_column(df)
@@ -94,18 +178,22 @@ def normalize_file_to_df(path: Path, *, max_rows: int | None = None) -> pd.DataF
         return pd.DataFrame(columns=["text", "ts", "user_id"])
 
     out = pd.DataFrame()
-    out["text"] = (
-        df[text_col]
-        .astype(str)
-        .map(lambda s: re.sub(r"\s+", " ", s).strip())
-    )
+    text = df[text_col].astype(str)
+    # схлопываем пробелы только в «грязных» строках (таб/перевод строки/двойной пробел),
+    # чистые строки только обрезаются
+    dirty = text.str.contains(_WS_DIRTY_RE, regex=True)
+    if dirty.any():
+        text = text.copy()
+        text[dirty] = text[dirty].str.replace(_WS_RE, " ", regex=True)
+    out["text"] = text.str.strip()
     out = out[out["text"] != ""]  # дроп пустых
 
     # ts (если есть)
     ts_col = _pick_first_existing(_TS_COLS, df)
     if ts_col:
-        # оставим timezone-aware (UTC), чтобы не падать на astype
-        out["ts"] = pd.to_datetime(df[ts_col], errors="coerce", utc=True)
+        # оставим timezone-aware (UTC), чтобы не падать на astype;
+        # парсим только строки, пережившие фильтр пустых текстов
+        out["ts"] = _parse_ts(df.loc[out.index, ts_col])
     else:
         out["ts"] = pd.NaT
 
@@ -127,10 +215,24 @@ def normalize_xlsx_to_df(path: Path, max_rows: int | None = None) -> pd.DataFram
     return normalize_file_to_df(path, max_rows=max_rows)
 
 
-def save_parquet_or_csv(df: pd.DataFrame, *, base_dir: Path) -> tuple[Path, Path]:
+def _write_parquet(df: pd.DataFrame, path: Path) -> None:
+    """Parquet (zstd) через polars, если он есть; иначе — pandas/pyarrow"""
+    if pl is not None:
+        try:
+            pl.from_pandas(df).write_parquet(path, compression="zstd", compression_level=3)
+            return
+        except Exception:
+            # смешанные типы в object-колонках polars не конвертирует — пишем через pandas
+            pass
+    df.to_parquet(path, index=False, compression="zstd")
+
+
+def save_parquet_or_csv(df: pd.DataFrame, *, base_dir: Path, force_csv: bool = False) -> tuple[Path, Optional[Path]]:
     """
     Сохраняем нормализованные логи в data/artifacts как parquet и csv.
-    Возвращаем пути (parquet_path, csv_path).
+    CSV-копия больших таблиц (от CSV_MIRROR_MAX_ROWS строк) пропускается, если parquet записан,
+    — кроме force_csv=True.
+    Возвращаем пути (parquet_path, csv_path); csv_path = None, если CSV не писался.
     """
     base_dir.mkdir(parents=True, exist_ok=True)
     art = base_dir / "artifacts"
@@ -139,13 +241,18 @@ def save_parquet_or_csv(df: pd.DataFrame, *, base_dir: Path) -> tuple[Path, Path
     p_parquet = art / "logs_norm.parquet"
     p_csv = art / "logs_norm.csv"
 
+    parquet_ok = True
     try:
-        df.to_parquet(p_parquet, index=False)
+        _write_parquet(df, p_parquet)
     except Exception:
         # если нет pyarrow/fastparquet — пропускаем
         p_parquet = art / "_skipped.parquet"
+        parquet_ok = False
 
-    df.to_csv(p_csv, index=False, encoding="utf-8")
+    if parquet_ok and not force_csv and len(df) >= CSV_MIRROR_MAX_ROWS:
+        # сериализация CSV на больших таблицах дорогая, а данные уже есть в parquet
+        return p_parquet, None
 
-    return p_parquet, p_csv
+    df.to_csv(p_csv, index=False, encoding="utf-8", lineterminator="\n")
 
+    return p_parquet, p_csv
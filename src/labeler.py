@@ -1,21 +1,68 @@
 from __future__ import annotations
-import json, time, asyncio, re
+import atexit, json, time, asyncio, re
+from collections import Counter
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, BinaryIO, Dict, List
 
 import pandas as pd
 
-from .llm import LLMClient
+try:
+    import orjson  # быстрый JSON для ответов LLM и сырого лога; если не установлен — stdlib json
+except ImportError:
+    orjson = None
+
+from .llm import LLMClient, RateLimiter
 from .cache import get_cache
 from .taxonomy import validate_domain, is_stop_word
 
 RAW_LOG = Path("data/llm_raw.jsonl")
 
+_json_loads = orjson.loads if orjson is not None else json.loads
+_DECODER = json.JSONDecoder()
+
+# Сырой лог пишется через один открытый файл; на диск — каждые RAW_FLUSH_EVERY записей и в конце разметки
+RAW_WRITE_BUFFER = 1 << 20
+RAW_FLUSH_EVERY = 200
+_raw_file: BinaryIO | None = None
+_raw_pending = 0
+
+def flush_raw_log() -> None:
+    """Сбрасывает буфер сырого лога LLM на диск"""
+    global _raw_pending
+    if _raw_file is not None:
+        try:
+            _raw_file.flush()
+        except Exception:
+            pass
+    _raw_pending = 0
+
+def _close_raw_log() -> None:
+    global _raw_file
+    flush_raw_log()
+    if _raw_file is not None:
+        try:
+            _raw_file.close()
+        except Exception:
+            pass
+        _raw_file = None
+
+atexit.register(_close_raw_log)
+
 def _write_raw(payload: dict) -> None:
+    global _raw_file, _raw_pending
     try:
-        RAW_LOG.parent.mkdir(parents=True, exist_ok=True)
-        with RAW_LOG.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        if orjson is not None:
+            line = orjson.dumps(payload, option=orjson.OPT_APPEND_NEWLINE)
+        else:
+            line = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        if _raw_file is None:
+            RAW_LOG.parent.mkdir(parents=True, exist_ok=True)
+            _raw_file = RAW_LOG.open("ab", buffering=RAW_WRITE_BUFFER)
+        _raw_file.write(line)
+        _raw_pending += 1
+        if _raw_pending >= RAW_FLUSH_EVERY:
+            flush_raw_log()
     except Exception:
         pass
 
@@ -25,80 +72,71 @@ def _embed_allowed(system_prompt: str, allowed_labels: List[str] | None) -> str:
     bullet = "\n".join(f"- {x}" for x in allowed_labels)
     return system_prompt + "\n\nВозможные домены (label set):\n" + bullet + "\n"
 
-def build_fewshot(system_prompt: str, fewshot: str, user_text: str, allowed_labels: List[str] | None=None) -> List[Dict[str, str]]:
-    sys = _embed_allowed(system_prompt, allowed_labels)
-    messages = [{"role": "system", "content": sys}]
+@lru_cache(maxsize=32)
+def _message_prefix(system_prompt: str, fewshot: str, allowed_labels: tuple | None) -> tuple:
+    # Общий префикс диалога (system + few-shot) собирается один раз на набор промптов;
+    # он побайтно одинаков для всех текстов, что позволяет бэкендам с prefix caching не пересчитывать его.
+    # В кэше — неизменяемые пары (role, content): dict-сообщения создаются заново на каждый вызов
+    sys = _embed_allowed(system_prompt, list(allowed_labels) if allowed_labels else None)
+    prefix = [("system", sys)]
     if fewshot:
-        messages.append({"role": "user", "content": fewshot})
-        messages.append({"role": "assistant", "content": "ОК"})
+        prefix.append(("user", fewshot))
+        prefix.append(("assistant", "ОК"))
+    return tuple(prefix)
+
+def build_fewshot(system_prompt: str, fewshot: str, user_text: str, allowed_labels: List[str] | None=None) -> List[Dict[str, str]]:
+    labels = tuple(allowed_labels) if allowed_labels else None
+    messages = [{"role": role, "content": content} for role, content in _message_prefix(system_prompt, fewshot, labels)]
     messages.append({"role": "user", "content": user_text})
     return messages
 
 def _extract_json(s: str) -> dict | None:
-    # вытащим первый JSON-объект из текста
+    # вытащим первый JSON-объект из текста: raw_decode разбирает объект с позиции "{"
+    # и не спотыкается о текст после него
+    i = s.find("{")
+    while i != -1:
+        try:
+            obj, _ = _DECODER.raw_decode(s, i)
+            if isinstance(obj, dict):
+                return obj
+        except ValueError:
+            pass
+        i = s.find("{", i + 1)
+    return None
+
+def _stop_word_result(text: str) -> Dict[str, Any]:
+    return {
+        "text": text,
+        "domain_id": "oos",
+        "domain_true": "oos", 
+        "confidence": 0.95,
+        "top_candidates": [["oos", 0.95]],
+    }
+
+def _parse_response(resp: Any) -> dict:
+    data = None
     try:
-        start = s.index("{")
-        end = s.rindex("}")
-        return json.loads(s[start:end+1])
+        # если библиотека уже вернула JSON-строку — парсим
+        data = _json_loads(resp) if isinstance(resp, str) else resp
     except Exception:
-        return None
+        pass
+    if not isinstance(data, dict):
+        # попробуем выдрать JSON из текста
+        data = _extract_json(str(resp)) or {}
+    return data
 
-def classify_one(
-    client: LLMClient,
-    system_prompt: str,
-    fewshot: str,
+# Домены в ответах LLM повторяются из строки в строку: нормализуем каждую строку один раз
+_validate_domain = lru_cache(maxsize=256)(validate_domain)
+
+def _finalize(
     text: str,
+    data: dict,
+    last_raw: Any,
     *,
-    allowed_labels: List[str] | None = None,
-    low_conf_threshold: float = 0.5,
+    allowed_labels: List[str] | None,
+    low_conf_threshold: float,
 ) -> Dict[str, Any]:
-    """
-    Возвращает:
-      {
-        "text": ...,
-        "domain_id": "house",
-        "domain_true": "house" (на старте = domain_id),
-        "confidence": 0.82,
-        "top_candidates": [["house",0.82],["payments",0.12],...]
-      }
-    """
-    # Проверяем стоп-слова
-    if is_stop_word(text):
-        return {
-            "text": text,
-            "domain_id": "oos",
-            "domain_true": "oos", 
-            "confidence": 0.95,
-            "top_candidates": [["oos", 0.95]],
-        }
-    
-    # Проверяем кэш
-    cache = get_cache()
-    if cache:
-        cached_result = cache.get_classification(text, system_prompt, fewshot)
-        if cached_result:
-            return cached_result
-    
-    messages = build_fewshot(system_prompt, fewshot, text, allowed_labels)
-    last_raw = None
-    for attempt in range(3):
-        # temperature=1.0 — совместимо с gpt-5-mini (без 400).
-        resp = client.chat(messages, response_json=True, temperature=1.0)
-        last_raw = resp
-        data = None
-        try:
-            # если библиотека уже вернула JSON-строку — парсим
-            data = json.loads(resp) if isinstance(resp, str) else resp
-        except Exception:
-            pass
-        if not isinstance(data, dict):
-            # попробуем выдрать JSON из текста
-            data = _extract_json(str(resp)) or {}
-
-        if "domain_id" in data:
-            break
-        time.sleep(0.3)
-
+    """Логирует сырой ответ и приводит его к итоговому результату разметки"""
     # логируем сырые материалы
     _write_raw({
         "type": "labeler",
@@ -112,34 +150,85 @@ def classify_one(
     cands = data.get("top_candidates") or data.get("candidates") or []
 
     # ВАЛИДАЦИЯ: проверяем что домен существует
-    domain = validate_domain(domain)
+    domain = _validate_domain(domain)
 
-    # нормализуем кандидатов и валидируем их
+    # нормализуем кандидатов и валидируем их; лучший кандидат — в том же проходе
     norm_cands: List[List[Any]] = []
+    best = None
     if isinstance(cands, list):
         for c in cands:
             if isinstance(c, (list, tuple)) and len(c) >= 2:
-                validated_domain = validate_domain(str(c[0]))
-                norm_cands.append([validated_domain, float(c[1])])
+                cand = [_validate_domain(str(c[0])), float(c[1])]
             elif isinstance(c, dict) and "label" in c and "score" in c:
-                validated_domain = validate_domain(str(c["label"]))
-                norm_cands.append([validated_domain, float(c["score"])])
+                cand = [_validate_domain(str(c["label"])), float(c["score"])]
+            else:
+                continue
+            norm_cands.append(cand)
+            if best is None or cand[1] > best[1]:
+                best = cand
     if not norm_cands:
         norm_cands = [[domain, conf]]
+        best = norm_cands[0]
 
     # если в кандидатах есть уверенный ≠ oos, не форсируем "oos"
-    best = max(norm_cands, key=lambda x: x[1]) if norm_cands else [domain, conf]
     if best[1] >= low_conf_threshold and best[0].lower() != "oos":
         domain = best[0]
         conf = best[1]
 
-    result = {
+    return {
         "text": text,
         "domain_id": domain,
         "domain_true": domain,
         "confidence": conf,
         "top_candidates": norm_cands,
     }
+
+def _cached_result(text: str, system_prompt: str, fewshot: str) -> Dict[str, Any] | None:
+    """Ответ без обращения к LLM: стоп-слово или попадание в кэш разметки"""
+    if is_stop_word(text):
+        return _stop_word_result(text)
+    cache = get_cache()
+    if cache:
+        return cache.get_classification(text, system_prompt, fewshot) or None
+    return None
+
+def classify_one(
+    client: LLMClient,
+    system_prompt: str,
+    fewshot: str,
+    text: str,
+    *,
+    allowed_labels: List[str] | None = None,
+    low_conf_threshold: float = 0.5,
+) -> Dict[str, Any]:
+    """
+    Возвращает:
+      {
+        "text": ...,
+        "domain_id": "house",
+        "domain_true": "house" (на старте = domain_id),
+        "confidence": 0.82,
+        "top_candidates": [["house",0.82],["payments",0.12],...]
+      }
+    """
+    # Стоп-слова и кэш
+    cached_result = _cached_result(text, system_prompt, fewshot)
+    if cached_result:
+        return cached_result
+    
+    cache = get_cache()
+    messages = build_fewshot(system_prompt, fewshot, text, allowed_labels)
+    last_raw = None
+    for attempt in range(3):
+        # temperature=1.0 — совместимо с gpt-5-mini (без 400).
+        resp = client.chat(messages, response_json=True, temperature=1.0)
+        last_raw = resp
+        data = _parse_response(resp)
+        if "domain_id" in data:
+            break
+        time.sleep(0.3)
+
+    result = _finalize(text, data, last_raw, allowed_labels=allowed_labels, low_conf_threshold=low_conf_threshold)
     
     # Сохраняем в кэш
     if cache:
@@ -147,6 +236,112 @@ def classify_one(
     
     return result
 
+async def aclassify_one(
+    client: LLMClient,
+    system_prompt: str,
+    fewshot: str,
+    text: str,
+    *,
+    allowed_labels: List[str] | None = None,
+    low_conf_threshold: float = 0.5,
+) -> Dict[str, Any]:
+    """Асинхронный classify_one: вызов LLM через achat, не блокирует event loop"""
+    cached_result = _cached_result(text, system_prompt, fewshot)
+    if cached_result:
+        return cached_result
+    
+    cache = get_cache()
+    messages = build_fewshot(system_prompt, fewshot, text, allowed_labels)
+    last_raw = None
+    for attempt in range(3):
+        resp = await client.achat(messages, response_json=True, temperature=1.0)
+        last_raw = resp
+        data = _parse_response(resp)
+        if "domain_id" in data:
+            break
+        await asyncio.sleep(0.3)
+
+    result = _finalize(text, data, last_raw, allowed_labels=allowed_labels, low_conf_threshold=low_conf_threshold)
+    
+    if cache:
+        cache.set_classification(text, system_prompt, fewshot, result)
+    
+    return result
+
+def _text_column(df: pd.DataFrame) -> str:
+    for cand in ["text", "query_text", "message", "q", "request"]:
+        if cand in df.columns:
+            return cand
+    raise RuntimeError("Не найден столбец с текстом (ожидаю: text / query_text / message / q / request)")
+
+async def _label_texts(
+    texts: List[str],
+    client: LLMClient,
+    system_prompt: str,
+    fewshot: str,
+    *,
+    rate_limit: float,
+    concurrency: int,
+    allowed_labels: List[str] | None,
+    low_conf_threshold: float,
+    on_done=None,
+) -> List[Dict[str, Any]]:
+    """
+    Размечает тексты конкурентно: до concurrency запросов одновременно,
+    старты разнесены на rate_limit секунд. Повторяющиеся тексты отправляются
+    в LLM один раз. Результаты — в порядке texts;
+    on_done(done, text) вызывается по мере завершения (done — число готовых строк).
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+    limiter = RateLimiter(rate_limit)
+    # В логах много одинаковых запросов: размечаем уникальные тексты
+    counts = Counter(texts)
+    results: Dict[str, Dict[str, Any]] = {}
+    done = 0
+    # Стоп-слова и попадания в кэш отвечаем сразу, не занимая rate limiter и слоты семафора
+    pending = []
+    last_hit = ""
+    for text in counts:
+        hit = _cached_result(text, system_prompt, fewshot)
+        if hit:
+            results[text] = hit
+            done += counts[text]
+            last_hit = text
+        else:
+            pending.append(text)
+    if done and on_done is not None:
+        await on_done(done, last_hit)
+
+    async def _one(text: str):
+        async with limiter:
+            pass
+        async with sem:
+            results[text] = await aclassify_one(
+                client, system_prompt, fewshot, text,
+                allowed_labels=allowed_labels, low_conf_threshold=low_conf_threshold
+            )
+        return text
+
+    tasks = [asyncio.ensure_future(_one(text)) for text in pending]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            text = await fut
+            done += counts[text]
+            if on_done is not None:
+                await on_done(done, text)
+    except BaseException:
+        # Ошибка прерывает разметку целиком, как и при последовательном проходе
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        cache = get_cache()
+        if cache:
+            cache.flush()
+        flush_raw_log()
+    # Каждой строке — своя копия результата, чтобы правки одной строки не задевали дубликаты
+    return [dict(results[text]) for text in texts]
+
 async def label_dataframe_batched(
     df: pd.DataFrame,
     client: LLMClient,
@@ -157,28 +352,18 @@ async def label_dataframe_batched(
     *,
     allowed_labels: List[str] | None = None,
     low_conf_threshold: float = 0.5,
+    concurrency: int = 16,
 ) -> List[Dict[str, Any]]:
     """
-    Последовательно размечает строки df.
-    Поддерживает rate_limit между вызовами.
+    Размечает строки df конкурентно (до concurrency запросов).
+    rate_limit — минимальный интервал между стартами запросов.
     """
-    rows: List[Dict[str, Any]] = []
-    text_col = None
-    for cand in ["text", "query_text", "message", "q", "request"]:
-        if cand in df.columns:
-            text_col = cand
-            break
-    if text_col is None:
-        raise RuntimeError("Не найден столбец с текстом (ожидаю: text / query_text / message / q / request)")
-
-    for i, val in enumerate(df[text_col].astype(str).tolist()):
-        item = classify_one(
-            client, system_prompt, fewshot, val,
-            allowed_labels=allowed_labels, low_conf_threshold=low_conf_threshold
-        )
-        rows.append(item)
-        await asyncio.sleep(rate_limit)
-    return rows
+    text_col = _text_column(df)
+    return await _label_texts(
+        df[text_col].astype(str).tolist(), client, system_prompt, fewshot,
+        rate_limit=rate_limit, concurrency=concurrency,
+        allowed_labels=allowed_labels, low_conf_threshold=low_conf_threshold,
+    )
 
 async def label_dataframe_batched_with_progress(
     df: pd.DataFrame,
@@ -191,41 +376,37 @@ async def label_dataframe_batched_with_progress(
     *,
     allowed_labels: List[str] | None = None,
     low_conf_threshold: float = 0.5,
+    concurrency: int = 16,
 ) -> List[Dict[str, Any]]:
     """
-    Последовательно размечает строки df с отслеживанием прогресса.
+    Размечает строки df конкурентно с отслеживанием прогресса.
     """
     from .progress import ProgressTracker  # Импорт внутри функции для избежания циклических импортов
     
-    rows: List[Dict[str, Any]] = []
-    text_col = None
-    for cand in ["text", "query_text", "message", "q", "request"]:
-        if cand in df.columns:
-            text_col = cand
-            break
-    if text_col is None:
-        raise RuntimeError("Не найден столбец с текстом (ожидаю: text / query_text / message / q / request)")
-
+    text_col = _text_column(df)
     text_list = df[text_col].astype(str).tolist()
     
+    reported = 0
+    
+    async def _on_done(done: int, val: str):
+        nonlocal reported
+        # Обновляем прогресс каждые 5 элементов или в конце (done растёт скачками на дубликатах)
+        if done // 5 > reported // 5 or done == len(text_list):
+            reported = done
+            await progress_tracker.update_progress(
+                done, 
+                f"Классифицирован: {val[:50]}..."
+            )
+    
     await progress_tracker.start()
     
     try:
-        for i, val in enumerate(text_list):
-            item = classify_one(
-                client, system_prompt, fewshot, val,
-                allowed_labels=allowed_labels, low_conf_threshold=low_conf_threshold
-            )
-            rows.append(item)
-            
-            # Обновляем прогресс каждые 5 элементов или в конце
-            if (i + 1) % 5 == 0 or i == len(text_list) - 1:
-                await progress_tracker.update_progress(
-                    i + 1, 
-                    f"Классифицирован: {val[:50]}..."
-                )
-            
-            await asyncio.sleep(rate_limit)
+        rows = await _label_texts(
+            text_list, client, system_prompt, fewshot,
+            rate_limit=rate_limit, concurrency=concurrency,
+            allowed_labels=allowed_labels, low_conf_threshold=low_conf_threshold,
+            on_done=_on_done,
+        )
             
         await progress_tracker.complete(f"✅ Классифицировано {len(rows)} текстов")
         
@@ -236,8 +417,23 @@ async def label_dataframe_batched_with_progress(
     return rows
 
 
-def low_conf_items(rows: List[Dict[str, Any]], threshold: float) -> List[Dict[str, Any]]:
-    return [r for r in rows if float(r.get("confidence", 0.0)) < float(threshold)]
+def _confidence_value(value: Any) -> float:
+    # То же правило, что pd.to_numeric(errors="coerce").fillna(0.0): None, NaN и нечисловое — 0.0
+    try:
+        conf = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if conf != conf else conf
+
+def low_conf_items(rows: List[Dict[str, Any]] | pd.DataFrame, threshold: float) -> List[Dict[str, Any]]:
+    threshold = float(threshold)
+    if isinstance(rows, pd.DataFrame):
+        # Для таблицы — векторная маска вместо прохода по строкам
+        if "confidence" not in rows.columns:
+            return rows.to_dict("records") if threshold > 0.0 else []
+        conf = pd.to_numeric(rows["confidence"], errors="coerce").fillna(0.0)
+        return rows[conf < threshold].to_dict("records")
+    return [r for r in rows if _confidence_value(r.get("confidence")) < threshold]
 
 
 
@@ -1,30 +1,87 @@
 # src/llm.py
 from __future__ import annotations
 
+import asyncio
+import atexit
+import functools
 import logging
+import time
+import weakref
 from typing import Any, Dict, List, Optional
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, OpenAI
 from openai import BadRequestError
 
 import tiktoken
 
 logger = logging.getLogger(__name__)
 
+try:
+    import h2  # noqa: F401  # HTTP/2 для httpx; без него асинхронный клиент работает по HTTP/1.1
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
 
-def _truncate_messages(messages: List[Dict[str, str]], max_tokens: int = 3500, model: str = "gpt-5-mini") -> List[Dict[str, str]]:
-    """
-    Грубое безопасное усечение последнего user-сообщения, если промпт слишком длинный.
-    """
+
+# Общие HTTP-пулы для всех LLMClient: соединения (и TLS-сессии) переиспользуются
+# между ролями (разметка, аугментация) и экземплярами клиента
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=64, max_connections=128, keepalive_expiry=60.0)
+_http_client: Optional[httpx.Client] = None
+# AsyncClient привязан к event loop, поэтому пул — свой на каждый loop
+_async_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _shared_http_client() -> httpx.Client:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.Client(limits=_HTTP_LIMITS)
+    return _http_client
+
+
+def _shared_async_http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(http2=_HTTP2, limits=_HTTP_LIMITS)
+        _async_http_clients[loop] = client
+    return client
+
+
+async def aclose_shared_clients() -> None:
+    """Закрывает асинхронный пул текущего event loop (вызывается из shutdown-хука API)"""
+    client = _async_http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+@atexit.register
+def _close_shared_http_client() -> None:
+    if _http_client is not None:
+        _http_client.close()
+
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model: str) -> "tiktoken.Encoding":
+    """BPE-кодировщик модели: таблица грузится один раз на модель"""
     try:
-        enc = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except Exception:
-        enc = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
 
-    def count(msgs: List[Dict[str, str]]) -> int:
-        return sum(len(enc.encode(m.get("content", "") or "")) for m in msgs)
+@functools.lru_cache(maxsize=256)
+def _token_count(model: str, text: str) -> int:
+    # system/few-shot префикс одинаков у всех запросов роли — считаем его токены один раз
+    return len(_encoding(model).encode(text))
 
-    total = count(messages)
+
+def _truncate_messages(messages: List[Dict[str, str]], max_tokens: int = 3500, model: str = "gpt-5-mini") -> List[Dict[str, str]]:
+    """
+    Грубое безопасное усечение последнего user-сообщения, если промпт слишком длинный.
+    """
+    enc = _encoding(model)
+    total = sum(_token_count(model, m.get("content", "") or "") for m in messages)
     if total <= max_tokens:
         return messages
 
@@ -37,18 +94,100 @@ def _truncate_messages(messages: List[Dict[str, str]], max_tokens: int = 3500, m
             toks = enc.encode(txt)
             if len(toks) > over + 100:  # оставим запас
                 toks = toks[: (len(toks) - over - 100)]
-                cut_messages[i]["content"] = enc.decode(toks) + "\n\n[TRUNCATED]"
+                cut_messages[i] = {**cut_messages[i], "content": enc.decode(toks) + "\n\n[TRUNCATED]"}
             break
     return cut_messages
 
 
+class RateLimiter:
+    """
+    Асинхронный token bucket ёмкостью 1: старты запросов разнесены не менее чем
+    на interval секунд по всем корутинам, но ожидание не занимает слот семафора.
+
+        limiter = RateLimiter(rate_limit)
+        async with limiter:
+            pass  # дождались своей очереди
+    """
+
+    def __init__(self, interval: float):
+        self.interval = max(0.0, interval)
+        self._next = 0.0
+
+    async def __aenter__(self) -> "RateLimiter":
+        if self.interval:
+            now = time.monotonic()
+            # Резервируем ближайший свободный слот без блокировок: event loop однопоточный
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        return None
+
+
 class LLMClient:
     def __init__(self, *, api_key: str, api_base: Optional[str], model: str):
         self.model = model
+        self._api_key = api_key
+        self._api_base = api_base
+        self._aclient: Optional[AsyncOpenAI] = None
+        self._aclient_http: Optional[httpx.AsyncClient] = None
         if api_base:
-            self.client = OpenAI(api_key=api_key, base_url=api_base)
+            self.client = OpenAI(api_key=api_key, base_url=api_base, http_client=_shared_http_client())
         else:
-            self.client = OpenAI(api_key=api_key)
+            self.client = OpenAI(api_key=api_key, http_client=_shared_http_client())
+
+    @property
+    def aclient(self) -> AsyncOpenAI:
+        """
+        Асинхронный клиент поверх общего пула текущего event loop: конкурентные
+        запросы всех LLMClient идут через одни соединения (мультиплексируются, если есть h2).
+        """
+        http_client = _shared_async_http_client()
+        if self._aclient is None or self._aclient_http is not http_client:
+            if self._api_base:
+                self._aclient = AsyncOpenAI(api_key=self._api_key, base_url=self._api_base, http_client=http_client)
+            else:
+                self._aclient = AsyncOpenAI(api_key=self._api_key, http_client=http_client)
+            self._aclient_http = http_client
+        return self._aclient
+
+    def _request_kwargs(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        response_json: bool,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+    ) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = dict(model=self.model, messages=messages)
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        if response_json:
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def _fix_kwargs(self, e: BadRequestError, kwargs: Dict[str, Any], messages: List[Dict[str, str]]) -> None:
+        """Правит параметры запроса по тексту 400-ошибки перед повтором"""
+        msg = (e.body or {}).get("error", {}).get("message", str(e))
+        low = msg.lower()
+        logger.warning("400 from OpenAI: %s", msg)
+
+        # temperature unsupported
+        if "temperature" in low and "unsupported" in low:
+            kwargs.pop("temperature", None)
+
+        # response_format unsupported
+        if "response_format" in low and "unsupported" in low:
+            kwargs.pop("response_format", None)
+
+        # context too long
+        if "context_length" in low or "maximum context length" in low:
+            kwargs["messages"] = _truncate_messages(messages, model=self.model)
 
     def chat(
         self,
@@ -64,35 +203,38 @@ class LLMClient:
         - unsupported response_format -> убираем JSON-режим и повторяем
         - context_length_exceeded -> подрезаем промпт и повторяем
         """
-        kwargs: Dict[str, Any] = dict(model=self.model, messages=messages)
-        if temperature is not None:
-            kwargs["temperature"] = temperature
-        if max_tokens is not None:
-            kwargs["max_tokens"] = max_tokens
-        if response_json:
-            kwargs["response_format"] = {"type": "json_object"}
+        kwargs = self._request_kwargs(messages, response_json=response_json, temperature=temperature, max_tokens=max_tokens)
 
         # 1-я попытка
         try:
             r = self.client.chat.completions.create(**kwargs)
             return (r.choices[0].message.content or "").strip()
         except BadRequestError as e:
-            msg = (e.body or {}).get("error", {}).get("message", str(e))
-            low = msg.lower()
-            logger.warning("400 from OpenAI: %s", msg)
+            self._fix_kwargs(e, kwargs, messages)
 
-            # temperature unsupported
-            if "temperature" in low and "unsupported" in low:
-                kwargs.pop("temperature", None)
+            # Повтор
+            r = self.client.chat.completions.create(**kwargs)
+            return (r.choices[0].message.content or "").strip()
 
-            # response_format unsupported
-            if "response_format" in low and "unsupported" in low:
-                kwargs.pop("response_format", None)
+    async def achat(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        response_json: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """
+        Асинхронный вариант chat(): не блокирует event loop, поэтому
+        конкурентные вызовы действительно выполняются параллельно.
+        """
+        kwargs = self._request_kwargs(messages, response_json=response_json, temperature=temperature, max_tokens=max_tokens)
 
-            # context too long
-            if "context_length" in low or "maximum context length" in low:
-                kwargs["messages"] = _truncate_messages(messages, model=self.model)
+        try:
+            r = await self.aclient.chat.completions.create(**kwargs)
+            return (r.choices[0].message.content or "").strip()
+        except BadRequestError as e:
+            self._fix_kwargs(e, kwargs, messages)
 
-            # Повтор
-            r = self.client.chat.completions.create(**kwargs)
+            r = await self.aclient.chat.completions.create(**kwargs)
             return (r.choices[0].message.content or "").strip()
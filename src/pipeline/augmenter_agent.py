@@ -21,7 +21,9 @@ from pydantic import BaseModel, Field
 from pydantic_ai import Agent
 from pydantic_ai.models.openai import OpenAIModel
 
-from ..cache import get_cache
+from ..cache import get_cache, get_semantic_cache
+from ..llm import RateLimiter
+from .prompts import read_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -98,7 +100,7 @@ class AugmenterAgent:
         """Загружает промпт из файла"""
         try:
             if path.exists():
-                return path.read_text(encoding="utf-8")
+                return read_prompt(path)
             else:
                 logger.warning(f"Prompt file not found: {path}, using default")
                 return self._get_default_prompt()
@@ -183,6 +185,23 @@ class AugmenterAgent:
                         variants=[item["text"] for item in cached],
                         success=True
                     )
+            
+            # Близкий перефраз уже аугментировался — переиспользуем варианты.
+            # Эмбеддинг считаем один раз и в пуле потоков: он нужен и для поиска, и для записи
+            sem_cache = get_semantic_cache()
+            if sem_cache:
+                vector = (await asyncio.to_thread(sem_cache.embed, [text]))[0]
+                cached = sem_cache.get_augmentation(text, domain, self.system_prompt, vector)
+                if cached:
+                    self.stats["cache_hits"] += 1
+                    self.stats["total_processed"] += 1
+                    self.stats["total_generated"] += len(cached)
+                    return AugmentationResult(
+                        original_text=text,
+                        domain=domain,
+                        variants=[item["text"] for item in cached],
+                        success=True
+                    )
         
         # Строим промпт
         user_prompt = self._build_user_prompt(text, domain)
@@ -200,13 +219,15 @@ class AugmenterAgent:
             
             # Сохраняем в кэш
             if self.config.use_cache:
+                cache_data = [
+                    {"text": variant, "domain_id": domain, "source": "aug_llm"}
+                    for variant in augmentation.variants
+                ]
                 cache = get_cache()
                 if cache:
-                    cache_data = [
-                        {"text": variant, "domain_id": domain, "source": "aug_llm"}
-                        for variant in augmentation.variants
-                    ]
                     cache.set_augmentation(text, domain, self.system_prompt, cache_data)
+                if sem_cache and cache_data:
+                    sem_cache.set_augmentation(text, domain, self.system_prompt, cache_data, vector)
             
             return augmentation
             
@@ -286,30 +307,36 @@ class AugmenterAgent:
         
         # Обрабатываем с ограничением конкурентности
         semaphore = asyncio.Semaphore(self.config.concurrency)
-        results: List[AugmentedSample] = []
+        limiter = RateLimiter(self.config.rate_limit)
+        # Результаты по индексу задачи: порядок выдачи совпадает с порядком входа,
+        # а не с порядком завершения запросов
+        per_task: List[List[AugmentedSample]] = [[] for _ in tasks]
+        done = 0
         
         async def _worker(idx: int, text: str, domain: str):
+            nonlocal done
+            # Rate limiting: ждём очереди до захвата слота, чтобы пауза не простаивала в семафоре
+            async with limiter:
+                pass
             async with semaphore:
                 result = await self.augment_one(text, domain)
                 
                 # Создаем AugmentedSample из вариантов
-                samples = []
-                for variant in result.variants:
-                    samples.append(AugmentedSample(
+                samples = [
+                    AugmentedSample(
                         text=variant,
                         domain_id=domain,
                         source="synthetic",
                         quality_score=1.0 if result.success else 0.5
-                    ))
-                
-                results.extend(samples)
+                    )
+                    for variant in result.variants
+                ]
+                per_task[idx] = samples
+                done += 1
                 
-                # Progress callback
+                # Progress callback: число завершённых задач
                 if progress_callback:
-                    await progress_callback(idx + 1, len(tasks), samples)
-                
-                # Rate limiting
-                await asyncio.sleep(self.config.rate_limit)
+                    await progress_callback(done, len(tasks), samples)
         
         # Запускаем все задачи
         await asyncio.gather(*[
@@ -317,8 +344,15 @@ class AugmenterAgent:
             for idx, (text, domain) in enumerate(tasks)
         ])
         
+        results = [sample for samples in per_task for sample in samples]
+        
         logger.info(f"Generated {len(results)} synthetic samples")
         
+        # Сбрасываем на диск записи кэша, накопленные за батч
+        for cache in (get_cache(), get_semantic_cache()):
+            if cache:
+                cache.flush()
+        
         return results
     
     def get_stats(self) -> Dict[str, Any]:
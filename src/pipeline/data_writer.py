@@ -22,8 +22,30 @@ from datetime import datetime
 
 from pydantic import BaseModel, Field
 
+try:
+    import orjson  # быстрая сериализация JSONL; если не установлен — stdlib json
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Буфер записи JSONL (меньше системных вызовов write на больших датасетах)
+JSONL_WRITE_BUFFER = 1 << 20
+
+
+def _json_default(obj: Any) -> Any:
+    # numpy-скаляры (confidence из pandas и т.п.) -> обычные числа
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _jsonl_line(obj: Any) -> bytes:
+    """Строка JSONL в UTF-8: orjson, если установлен, иначе stdlib json"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False, default=_json_default) + "\n").encode("utf-8")
+
 
 class DataWriterConfig(BaseModel):
     """Конфигурация DataWriter"""
@@ -316,11 +338,11 @@ class DataWriter:
         # Записываем обычный файл
         path.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(path, "w", encoding="utf-8") as f:
+        with open(path, "wb", buffering=JSONL_WRITE_BUFFER) as f:
             for item in items:
                 # Нормализуем формат
                 normalized = self._normalize_item(item)
-                f.write(json.dumps(normalized, ensure_ascii=False) + "\n")
+                f.write(_jsonl_line(normalized))
         
         return path
     
@@ -342,18 +364,18 @@ class DataWriter:
             shard_items = items[start_idx:end_idx]
             shard_path = shard_dir / f"{base_name}_part_{shard_idx+1:04d}.jsonl"
             
-            with open(shard_path, "w", encoding="utf-8") as f:
+            with open(shard_path, "wb", buffering=JSONL_WRITE_BUFFER) as f:
                 for item in shard_items:
                     normalized = self._normalize_item(item)
-                    f.write(json.dumps(normalized, ensure_ascii=False) + "\n")
+                    f.write(_jsonl_line(normalized))
             
             logger.info(f"Written shard {shard_idx+1}/{num_shards}: {shard_path}")
         
         # Записываем также consolidated файл
-        with open(base_path, "w", encoding="utf-8") as f:
+        with open(base_path, "wb", buffering=JSONL_WRITE_BUFFER) as f:
             for item in items:
                 normalized = self._normalize_item(item)
-                f.write(json.dumps(normalized, ensure_ascii=False) + "\n")
+                f.write(_jsonl_line(normalized))
         
         return base_path
     
@@ -464,9 +486,9 @@ def write_jsonl(path: Path, rows: List[Dict[str, Any]]) -> bool:
     
     path.parent.mkdir(parents=True, exist_ok=True)
     
-    with open(path, "w", encoding="utf-8") as f:
-        for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    # Крупный буфер: строки уходят на диск блоками ~1 MiB, а не по 8 KiB
+    with open(path, "wb", buffering=JSONL_WRITE_BUFFER) as f:
+        f.writelines(_jsonl_line(r) for r in rows)
     
     return True
 
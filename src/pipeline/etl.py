@@ -15,7 +15,7 @@ import io
 import re
 import logging
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
 from datetime import datetime
 
 import pandas as pd
@@ -23,6 +23,14 @@ from pydantic import BaseModel, Field, validator
 
 logger = logging.getLogger(__name__)
 
+try:
+    import python_calamine  # noqa: F401  # Rust-парсер xlsx/xls для pandas (engine="calamine")
+    EXCEL_ENGINE: Optional[str] = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None  # pandas выберет openpyxl/xlrd сам
+
+_WS_RE = re.compile(r"\s+")
+
 
 class ETLConfig(BaseModel):
     """Конфигурация ETL процесса"""
@@ -113,8 +121,191 @@ class ETLProcessor:
             self.stats["errors"] += 1
             return pd.DataFrame(columns=["text", "ts", "user_id", "source", "metadata"])
         
+        df = self._records_to_df(raw_df, source)
+        if df is None:
+            logger.warning("No valid records found")
+            return pd.DataFrame(columns=["text", "ts", "user_id", "source", "metadata"])
+        
+        # Дополнительная обработка
+        df = self._post_process(df)
+        
+        self.stats["processed_rows"] = len(df)
+        self.stats["filtered_rows"] = self.stats["total_rows"] - self.stats["processed_rows"]
+        
+        logger.info(f"ETL Stats: {self.stats}")
+        
+        return df
+    
+    def iter_chunks(
+        self,
+        file_path: Path,
+        chunksize: int = 50_000,
+        source_name: Optional[str] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Обрабатывает файл по частям и отдает нормализованные DataFrame чанками.
+        
+        CSV, JSONL и Parquet читаются потоково; остальные форматы — одним чанком.
+        Дедупликация действует на весь файл, сортировка по ts — внутри чанка.
+        При заданном max_rows результат совпадает с process_file: весь файл
+        сортируется по ts и берутся первые max_rows строк (отдается одним чанком).
+        
+        Args:
+            file_path: путь к файлу
+            chunksize: строк исходного файла на чанк
+            source_name: название источника (для метаданных)
+            
+        Yields:
+            DataFrame с колонками: text, ts, user_id, source, metadata
+        """
+        logger.info(f"Processing file in chunks: {file_path}")
+        
+        source = source_name or file_path.stem
+        
+        if self.config.max_rows:
+            # Самые ранние max_rows строки можно выбрать только после чтения всего файла
+            df = self._collect_chunks(file_path, chunksize, source)
+            if not df.empty:
+                yield df
+            return
+        
+        seen_texts = set()
+        emitted = 0
+        
+        for raw_df in self._iter_raw_chunks(file_path, chunksize):
+            self.stats["total_rows"] += len(raw_df)
+            
+            df = self._records_to_df(raw_df, source)
+            if df is None:
+                continue
+            
+            if self.config.deduplicate:
+                before = len(df)
+                df = df.drop_duplicates(subset=["text"], keep="first")
+                df = df[~df["text"].isin(seen_texts)]
+                seen_texts.update(df["text"])
+                self.stats["duplicates_removed"] += before - len(df)
+            
+            if "ts" in df.columns and df["ts"].notna().any():
+                df = df.sort_values("ts")
+            
+            if df.empty:
+                continue
+            
+            emitted += len(df)
+            self.stats["processed_rows"] = emitted
+            self.stats["filtered_rows"] = self.stats["total_rows"] - emitted
+            
+            yield df.reset_index(drop=True)
+        
+        logger.info(f"ETL Stats: {self.stats}")
+    
+    def _collect_chunks(self, file_path: Path, chunksize: int, source: str) -> pd.DataFrame:
+        """Читает файл чанками и применяет к целому результату ту же пост-обработку, что process_file"""
+        
+        frames = []
+        for raw_df in self._iter_raw_chunks(file_path, chunksize):
+            self.stats["total_rows"] += len(raw_df)
+            df = self._records_to_df(raw_df, source)
+            if df is not None:
+                frames.append(df)
+        
+        if not frames:
+            logger.warning("No valid records found")
+            return pd.DataFrame(columns=["text", "ts", "user_id", "source", "metadata"])
+        
+        df = self._post_process(pd.concat(frames, ignore_index=True))
+        
+        self.stats["processed_rows"] = len(df)
+        self.stats["filtered_rows"] = self.stats["total_rows"] - len(df)
+        
+        logger.info(f"ETL Stats: {self.stats}")
+        
+        return df
+    
+    def _iter_raw_chunks(self, path: Path, chunksize: int) -> Iterator[pd.DataFrame]:
+        """Читает файл чанками (где формат это позволяет)"""
+        
+        suffix = path.suffix.lower()
+        
+        if suffix == ".csv":
+            yield from self._iter_csv_chunks(path, chunksize)
+        
+        elif suffix == ".jsonl":
+            with pd.read_json(path, lines=True, chunksize=chunksize) as reader:
+                yield from reader
+        
+        elif suffix == ".parquet":
+            import pyarrow.parquet as pq
+            
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+                yield batch.to_pandas()
+        
+        else:
+            yield self._read_file(path)
+    
+    def _iter_csv_chunks(self, path: Path, chunksize: int) -> Iterator[pd.DataFrame]:
+        """
+        Читает CSV чанками с кодировкой и разделителем, определенными по началу файла.
+        Если дальше по файлу они не подходят (например, cp1251 после ASCII-префикса),
+        дочитывает файл целиком через _read_file, пропуская уже отданные строки.
+        """
+        
+        yielded = 0
+        try:
+            encoding, sep, dtype = self._sniff_csv(path)
+            if sep is None:
+                reader = pd.read_csv(path, encoding=encoding, engine="python", chunksize=chunksize)
+            else:
+                reader = pd.read_csv(path, encoding=encoding, sep=sep, engine="c", dtype=dtype, chunksize=chunksize)
+            with reader:
+                for chunk in reader:
+                    yield chunk
+                    yielded += len(chunk)
+            return
+        except (UnicodeDecodeError, pd.errors.ParserError) as e:
+            logger.warning(f"Chunked CSV read failed for {path} after {yielded} rows, falling back: {e}")
+        
+        df = self._read_file(path)
+        if yielded:
+            df = df.iloc[yielded:]
+        if not df.empty:
+            yield df
+    
+    def _sniff_csv(self, path: Path, sample_size: int = 1 << 20):
+        """
+        Определяет кодировку, разделитель и dtype текстовых колонок CSV по началу файла.
+        Текстовые колонки читаются как str — без вывода типов и без превращения "0123" в число.
+        """
+        
+        with open(path, "rb") as f:
+            sample = f.read(sample_size)
+        
+        # Обрезаем по последней целой строке, чтобы не разрезать многобайтный символ
+        if len(sample) == sample_size and b"\n" in sample:
+            sample = sample[:sample.rindex(b"\n") + 1]
+        
+        encoding = self._detect_encoding(sample)
+        
+        for sep in (",", ";", "\t", "|"):
+            try:
+                df = pd.read_csv(io.BytesIO(sample), encoding=encoding, sep=sep)
+                if len(df.columns) > 1:  # Хотя бы 2 колонки
+                    dtype = {
+                        col: str for col in df.columns
+                        if str(col).strip().lower() in self.TEXT_COLUMN_CANDIDATES
+                    }
+                    return encoding, sep, dtype
+            except Exception:
+                continue
+        
+        return encoding, None, None
+    
+    def _records_to_df(self, raw_df: pd.DataFrame, source: str) -> Optional[pd.DataFrame]:
+        """Нормализует сырые строки в DataFrame записей (None, если валидных нет)"""
+        
         # Нормализуем колонки
-        raw_df.columns = [str(c).strip().lower() for c in raw_df.columns]
+        raw_df.columns = raw_df.columns.astype(str).str.strip().str.lower()
         
         # Извлекаем данные
         processed_records = []
@@ -131,20 +322,9 @@ class ETLProcessor:
         
         # Создаем DataFrame из обработанных записей
         if not processed_records:
-            logger.warning("No valid records found")
-            return pd.DataFrame(columns=["text", "ts", "user_id", "source", "metadata"])
-        
-        df = pd.DataFrame([record.dict() for record in processed_records])
-        
-        # Дополнительная обработка
-        df = self._post_process(df)
-        
-        self.stats["processed_rows"] = len(df)
-        self.stats["filtered_rows"] = self.stats["total_rows"] - self.stats["processed_rows"]
-        
-        logger.info(f"ETL Stats: {self.stats}")
+            return None
         
-        return df
+        return pd.DataFrame([record.dict() for record in processed_records])
     
     def _read_file(self, path: Path) -> pd.DataFrame:
         """Читает файл в зависимости от расширения"""
@@ -152,7 +332,7 @@ class ETLProcessor:
         suffix = path.suffix.lower()
         
         if suffix in (".xlsx", ".xls"):
-            return pd.read_excel(path)
+            return pd.read_excel(path, engine=EXCEL_ENGINE)
         
         elif suffix == ".csv":
             return self._read_csv_smart(path)
@@ -172,6 +352,15 @@ class ETLProcessor:
     def _read_csv_smart(self, path: Path) -> pd.DataFrame:
         """Читает CSV с автодетекцией кодировки и разделителя"""
         
+        # Разделитель определяем по началу файла, затем один полный проход C-парсером
+        # (раньше файл мог целиком разбираться до четырёх раз — по разу на разделитель)
+        encoding, sep, dtype = self._sniff_csv(path)
+        if sep is not None:
+            try:
+                return pd.read_csv(path, encoding=encoding, sep=sep, engine="c", dtype=dtype)
+            except Exception as e:
+                logger.warning(f"Fast CSV read failed for {path}, falling back: {e}")
+        
         raw_bytes = path.read_bytes()
         
         # Определяем кодировку
@@ -293,7 +482,7 @@ class ETLProcessor:
         
         if self.config.normalize_whitespace:
             # Заменяем все виды пробелов на обычные
-            text = re.sub(r'\s+', ' ', text)
+            text = _WS_RE.sub(' ', text)
         
         return text.strip()
     
@@ -25,6 +25,7 @@ from pydantic_ai.models.openai import OpenAIModel
 
 from ..taxonomy import CANON_LABELS, validate_domain, is_stop_word
 from ..cache import get_cache
+from .prompts import read_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -113,7 +114,7 @@ class LabelerAgent:
         """Загружает промпт из файла"""
         try:
             if path.exists():
-                return path.read_text(encoding="utf-8")
+                return read_prompt(path)
             else:
                 logger.warning(f"Prompt file not found: {path}")
                 return ""
@@ -235,7 +236,7 @@ class LabelerAgent:
                 cache = get_cache()
                 if cache:
                     cache_key = self._build_cache_key(text, allowed_labels, user_context)
-                    cache.set_classification(text, cache_key, "", classification.dict())
+                    cache.set_classification(text, cache_key, "", classification.model_dump())
             
             return classification
             
@@ -341,6 +342,11 @@ class LabelerAgent:
                     reasoning=f"Error: {str(e)}"
                 ))
         
+        # Сбрасываем на диск записи кэша, накопленные за батч
+        cache = get_cache()
+        if cache:
+            cache.flush()
+        
         return results
     
     async def classify_dataframe(
@@ -442,5 +448,5 @@ async def label_dataframe_batched(
     results = await agent.classify_dataframe(df)
     
     # Конвертируем в старый формат
-    return [result.dict() for result in results]
+    return [result.model_dump() for result in results]
 
@@ -0,0 +1,27 @@
+"""
+Чтение файлов промптов с кэшем
+
+Промпты читаются с диска один раз; повторное чтение происходит
+только если файл изменился (ключ кэша — путь и mtime).
+"""
+
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from pathlib import Path
+
+
+@lru_cache(maxsize=16)
+def _read_prompt_cached(path: str, mtime_ns: int) -> str:
+    return Path(path).read_text(encoding="utf-8")
+
+
+def read_prompt(path: Path) -> str:
+    """
+    Возвращает текст промпта из файла.
+    
+    Raises:
+        FileNotFoundError: если файла нет
+    """
+    return _read_prompt_cached(str(path), os.stat(path).st_mtime_ns)
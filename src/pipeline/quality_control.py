@@ -16,8 +16,8 @@ from dataclasses import dataclass
 
 import numpy as np
 from pydantic import BaseModel, Field
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
 
 logger = logging.getLogger(__name__)
 
@@ -161,6 +161,8 @@ class QualityControl:
             ngram_range=(1, 2),
             min_df=1
         )
+        # Корпус, на котором обучен vectorizer: при повторном вызове с тем же корпусом fit пропускается
+        self._fit_corpus: Optional[List[str]] = None
         
         # Статистика
         self.stats = {
@@ -176,7 +178,8 @@ class QualityControl:
         self,
         text1: str,
         text2: str,
-        reference_corpus: Optional[List[str]] = None
+        reference_corpus: Optional[List[str]] = None,
+        cos_sim: Optional[float] = None,
     ) -> QualityMetrics:
         """
         Вычисляет метрики схожести между двумя текстами.
@@ -185,29 +188,15 @@ class QualityControl:
             text1: первый текст (обычно оригинал)
             text2: второй текст (обычно аугментированный)
             reference_corpus: опциональный корпус для обучения TF-IDF
+            cos_sim: заранее посчитанное косинусное сходство (см. batch_cosine_similarity)
             
         Returns:
             QualityMetrics с косинусным и Левенштейн расстояниями
         """
         
         # Косинусное сходство через TF-IDF
-        corpus = [text1, text2]
-        if reference_corpus:
-            corpus = reference_corpus + corpus
-        
-        try:
-            # Обучаем векторизатор на корпусе
-            tfidf_matrix = self.vectorizer.fit_transform(corpus)
-            
-            # Берем векторы последних двух текстов
-            vec1 = tfidf_matrix[-2].toarray()
-            vec2 = tfidf_matrix[-1].toarray()
-            
-            # Косинусное сходство
-            cos_sim = float(cosine_similarity(vec1, vec2)[0][0])
-        except Exception as e:
-            logger.warning(f"Failed to compute cosine similarity: {e}")
-            cos_sim = 0.5  # fallback
+        if cos_sim is None:
+            cos_sim = self.batch_cosine_similarity([(text1, text2)], reference_corpus)[0]
         
         # Расстояние Левенштейна
         lev_dist = levenshtein_distance(text1.lower(), text2.lower())
@@ -245,6 +234,51 @@ class QualityControl:
             issues=issues
         )
     
+    def batch_cosine_similarity(
+        self,
+        pairs: List[Tuple[str, str]],
+        reference_corpus: Optional[List[str]] = None,
+    ) -> List[float]:
+        """
+        Косинусное сходство TF-IDF для списка пар текстов.
+        
+        Векторизатор обучается один раз на корпусе и всех парах,
+        а не заново для каждой пары. Каждый уникальный текст векторизуется
+        один раз; строки матрицы переиспользуются всеми парами, где он встречается.
+        
+        Args:
+            pairs: пары (оригинал, вариант)
+            reference_corpus: опциональный корпус для обучения TF-IDF
+            
+        Returns:
+            Список сходств в порядке pairs
+        """
+        if not pairs:
+            return []
+        
+        left_texts = [text1 for text1, _ in pairs]
+        right_texts = [text2 for _, text2 in pairs]
+        
+        try:
+            fit_corpus = (reference_corpus or []) + left_texts + right_texts
+            if fit_corpus != self._fit_corpus:
+                self._fit_corpus = None
+                self.vectorizer.fit(fit_corpus)
+                self._fit_corpus = fit_corpus
+            
+            # Один оригинал обычно даёт несколько вариантов — векторизуем уникальные тексты
+            row_of = {text: i for i, text in enumerate(dict.fromkeys(left_texts + right_texts))}
+            matrix = self.vectorizer.transform(list(row_of))
+            left = matrix[[row_of[text] for text in left_texts]]
+            right = matrix[[row_of[text] for text in right_texts]]
+            
+            # Строки TF-IDF L2-нормированы: косинус = скалярное произведение строк
+            sims = np.asarray(left.multiply(right).sum(axis=1)).ravel()
+            return [float(sim) for sim in sims]
+        except Exception as e:
+            logger.warning(f"Failed to compute cosine similarity: {e}")
+            return [0.5] * len(pairs)  # fallback
+    
     async def validate_existing_labels(
         self,
         items: List[Dict[str, Any]],
@@ -332,17 +366,18 @@ class QualityControl:
         # Создаем корпус оригинальных текстов для TF-IDF
         original_texts = [item.get("text", "") for item in original_items]
         
-        # Группируем синтетику по исходному тексту
-        synthetic_by_original = {}
-        for syn_item in synthetic_items:
-            original_text = syn_item.get("original_text", syn_item.get("text", ""))
-            if original_text not in synthetic_by_original:
-                synthetic_by_original[original_text] = []
-            synthetic_by_original[original_text].append(syn_item)
-        
         validated_items = []
         
-        for syn_item in synthetic_items:
+        # Косинусное сходство для всех пар (оригинал, синтетика) за один проход TF-IDF
+        cos_sims = self.batch_cosine_similarity(
+            [
+                (syn_item.get("original_text", syn_item.get("text", "")), syn_item.get("text", ""))
+                for syn_item in synthetic_items
+            ],
+            reference_corpus=original_texts,
+        )
+        
+        for syn_item, cos_sim in zip(synthetic_items, cos_sims):
             text = syn_item.get("text", "")
             expected_domain = syn_item.get("domain_id", "")
             original_text = syn_item.get("original_text", text)
@@ -351,7 +386,7 @@ class QualityControl:
             quality_metrics = self.compute_similarity(
                 original_text,
                 text,
-                reference_corpus=original_texts
+                cos_sim=cos_sim
             )
             
             # Логируем проблемы
@@ -440,6 +475,8 @@ class QualityControl:
         
         # TF-IDF векторизация
         try:
+            # vectorizer переобучается на другом корпусе — мемо batch_cosine_similarity больше не верно
+            self._fit_corpus = None
             tfidf_matrix = self.vectorizer.fit_transform(texts)
             
             # Вычисляем попарные косинусные расстояния
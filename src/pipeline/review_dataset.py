@@ -461,5 +461,6 @@ def low_conf_items(rows: List[Dict[str, Any]], threshold: float) -> List[Dict[st
     Совместимость со старым API.
     Возвращает элементы с низкой уверенностью.
     """
-    return [r for r in rows if float(r.get("confidence", 0.0)) < float(threshold)]
+    threshold = float(threshold)
+    return [r for r in rows if float(r.get("confidence", 0.0)) < threshold]
 
@@ -92,12 +92,19 @@ class Store:
     def append_hitl_queue(self, items: Iterable[Dict[str, Any]]) -> Path:
         """
         Добавляет элементы в artifacts/hitl_queue.jsonl (по одному на строку).
+        Весь батч уходит одним write() в режиме O_APPEND: строки параллельных
+        добавлений не перемешиваются, и на батч — один системный вызов.
+        Файл открывается на каждый вызов (а не держится открытым, как в LLMCache):
+        очередь сразу видна read_hitl_queue и ревьюерам, без ожидания flush.
         """
         p = self.artifacts_dir / "hitl_queue.jsonl"
         p.parent.mkdir(parents=True, exist_ok=True)
-        with open(p, "a", encoding="utf-8") as f:
-            for it in items or []:
-                f.write(json.dumps(it, ensure_ascii=False) + "\n")
+        payload = "".join(json.dumps(it, ensure_ascii=False) + "\n" for it in items or []).encode("utf-8")
+        with open(p, "ab", buffering=0) as f:
+            # write() без буфера может записать не всё — дописываем остаток
+            view = memoryview(payload)
+            while view:
+                view = view[f.write(view):]
         return p
 
     def read_hitl_queue(self, limit: int | None = None) -> List[Dict[str, Any]]:
@@ -61,6 +61,12 @@ ALIASES: Dict[str, str] = {
     "OOS": "oos",
 }
 
+# Стоп-слова которые не должны классифицироваться (собираются один раз, а не на каждую строку)
+STOP_WORDS = frozenset({
+    "хватит", "перестань", "достаточно", "стоп", "прекрати", 
+    "остановись", "хватит уже", "перестаньте", "прекратите"
+})
+
 def normalize_label(label: str) -> str:
     """Нормализует ярлык к каноническому id (если это алиас)."""
     if not isinstance(label, str) or not label:
@@ -82,15 +88,7 @@ def is_stop_word(text: str) -> bool:
     if not isinstance(text, str):
         return False
     
-    text_clean = text.strip().lower()
-    
-    # Стоп-слова которые не должны классифицироваться
-    stop_words = {
-        "хватит", "перестань", "достаточно", "стоп", "прекрати", 
-        "остановись", "хватит уже", "перестаньте", "прекратите"
-    }
-    
-    return text_clean in stop_words
+    return text.strip().lower() in STOP_WORDS
 
 def validate_domain(domain: str) -> str:
     """Валидирует домен и приводит к каноническому виду"""
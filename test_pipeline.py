@@ -7,7 +7,9 @@
 
 import asyncio
 import json
+from datetime import datetime
 from pathlib import Path
+from typing import Literal, Optional
 
 # Проверка импортов
 print("🔍 Проверка импортов...")
@@ -188,6 +190,187 @@ async def test_components():
     return True
 
 
+def test_config_loader():
+    """Проверяет разбор переменных окружения в config_v2 (без .env и без LLM)"""
+    
+    print("\n" + "="*60)
+    print("⚙️  Тестирование загрузки конфигурации")
+    print("="*60)
+    
+    from src.config_v2 import (
+        _coerce, _load, _upper_env,
+        AppConfig, CacheConfig, ETLConfig as EnvETLConfig, LLMConfig, TelegramConfig,
+    )
+    
+    def expect_error(fn, *args):
+        try:
+            fn(*args)
+        except ValueError as e:
+            return str(e)
+        raise AssertionError(f"ожидалась ошибка для {args}")
+    
+    try:
+        # bool
+        for raw in ("1", "true", "Yes", " ON "):
+            assert _coerce(raw, bool, "X") is True, raw
+        for raw in ("0", "false", "No", "off"):
+            assert _coerce(raw, bool, "X") is False, raw
+        assert "X" in expect_error(_coerce, "maybe", bool, "X")
+        print("   ✅ bool")
+        
+        # int / float
+        assert _coerce(" 42 ", int, "X") == 42
+        assert _coerce("0.5", float, "X") == 0.5
+        assert "int" in expect_error(_coerce, "4.2", int, "X")
+        print("   ✅ int / float")
+        
+        # Optional: пустая строка → None, иначе тип аргумента
+        assert _coerce("", Optional[int], "X") is None
+        assert _coerce("   ", Optional[str], "X") is None
+        assert _coerce("10", Optional[int], "X") == 10
+        assert _coerce("", str, "X") == ""
+        print("   ✅ Optional и правило пустая строка → None")
+        
+        # Literal
+        mode = Literal["development", "production"]
+        assert _coerce("production", mode, "X") == "production"
+        assert "production" in expect_error(_coerce, "prod", mode, "X")
+        print("   ✅ Literal")
+        
+        # _load: значения по умолчанию, приведение типов и обязательные поля
+        etl = _load(EnvETLConfig, "ETL_", {"ETL_MAX_ROWS": "100", "ETL_DEDUPLICATE": "false"})
+        assert etl.max_rows == 100 and etl.deduplicate is False and etl.min_text_length == 3
+        assert _load(LLMConfig, "LLM_", {"LLM_API_BASE": ""}).api_base is None
+        assert "TELEGRAM_BOT_TOKEN" in expect_error(_load, TelegramConfig, "TELEGRAM_", {})
+        assert _load(TelegramConfig, "TELEGRAM_", {"TELEGRAM_BOT_TOKEN": "t", "TELEGRAM_PORT": "9000"}).port == 9000
+        assert "APP_MODE" in expect_error(_load, AppConfig, "APP_", {"APP_MODE": "staging"})
+        assert "CACHE_SEMANTIC_THRESHOLD" in expect_error(_load, CacheConfig, "CACHE_", {"CACHE_SEMANTIC_THRESHOLD": "2"})
+        print("   ✅ _load: умолчания, приведение типов, обязательные поля")
+        
+        # Имена переменных без учета регистра (как в pydantic-settings)
+        env = _upper_env({"llm_model": "local", "Etl_Max_Rows": "5", "etl_deduplicate": "0", "ETL_DEDUPLICATE": "1"})
+        assert _load(LLMConfig, "LLM_", env).model == "local"
+        etl = _load(EnvETLConfig, "ETL_", env)
+        assert etl.max_rows == 5 and etl.deduplicate is True
+        print("   ✅ Имена переменных без учета регистра")
+        
+    except Exception as e:
+        print(f"   ❌ Ошибка: {e!r}")
+        return False
+    
+    return True
+
+
+def test_offline_components():
+    """Проверяет компоненты без LLM: потоковый ETL, старый формат контекста, старые ключи кэша, дубликаты"""
+    
+    print("\n" + "="*60)
+    print("🧩 Тестирование компонентов без LLM")
+    print("="*60)
+    
+    import hashlib
+    import tempfile
+    from src.cache import LLMCache
+    from src.context import UserContext
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            
+            # 1. iter_chunks: дедупликация между чанками и max_rows по всему файлу
+            print("\n📥 ETL iter_chunks")
+            test_csv = tmp / "chunks.csv"
+            test_csv.write_text(
+                "text,ts\n"
+                "передать показания счетчика,2024-01-05\n"
+                "оплатить питание в школе,2024-01-04\n"
+                "передать показания счетчика,2024-01-03\n"
+                "узнать расписание метро,2024-01-02\n"
+                "записаться к врачу,2024-01-01\n",
+                encoding="utf-8"
+            )
+            
+            etl = ETLProcessor(ETLConfig())
+            chunks = list(etl.iter_chunks(test_csv, chunksize=2))
+            texts = [t for chunk in chunks for t in chunk["text"]]
+            assert len(chunks) > 1, "ожидалось несколько чанков"
+            assert len(texts) == len(set(texts)) == 4, texts
+            assert etl.get_stats()["duplicates_removed"] == 1
+            print(f"   ✅ {len(chunks)} чанков, дубликаты между чанками удалены")
+            
+            etl = ETLProcessor(ETLConfig(max_rows=2))
+            limited = list(etl.iter_chunks(test_csv, chunksize=2))
+            expected = etl.process_file(test_csv)["text"].tolist()
+            got = [t for chunk in limited for t in chunk["text"]]
+            assert got == expected == ["записаться к врачу", "узнать расписание метро"], got
+            print("   ✅ max_rows: самые ранние строки по ts, как в process_file")
+            
+            # 2. UserContext.from_dict: старый формат без domain_counts
+            print("\n👤 UserContext.from_dict (старый формат)")
+            legacy_context = {
+                "user_id": "u1",
+                "message_history": [
+                    {"timestamp": "2024-01-01T10:00:00", "text": "счетчик", "predicted_domain": "house"},
+                    {"timestamp": "2024-01-01T10:01:00", "text": "вода", "predicted_domain": "house"},
+                    {"timestamp": "2024-01-01T10:02:00", "text": "кружок", "predicted_domain": "payments"},
+                    {"timestamp": "2024-01-01T10:03:00", "text": "метро", "predicted_domain": "okc"},
+                ],
+                "domain_preferences": {"house": 0.5, "payments": 0.25, "okc": 0.25},
+                "last_activity": "2024-01-01T10:03:00",
+            }
+            context = UserContext.from_dict(legacy_context)
+            assert context.message_count == 4
+            assert context.domain_counts == {"house": 2.0, "payments": 1.0, "okc": 1.0}
+            assert context.domain_preferences == legacy_context["domain_preferences"]
+            assert context.get_preferred_domains(1) == ["house"]
+            print("   ✅ Доли восстановлены в счётчики в масштабе истории")
+            
+            # 3. LLMCache: записи со старыми md5-ключами находятся после смены алгоритма
+            print("\n🗄️  LLMCache (старые md5-ключи)")
+            cache_dir = tmp / "cache"
+            (cache_dir / "llm_cache").mkdir(parents=True)
+            legacy_key = hashlib.md5("старый текст|prompt|fewshot".encode("utf-8")).hexdigest()
+            legacy_entry = {
+                "key": legacy_key,
+                "text": "старый текст",
+                "result": {"domain_id": "house"},
+                "timestamp": datetime.now().isoformat(),
+            }
+            (cache_dir / "llm_cache" / "classification_cache.jsonl").write_text(
+                json.dumps(legacy_entry, ensure_ascii=False) + "\n", encoding="utf-8"
+            )
+            
+            cache = LLMCache(cache_dir)
+            assert cache.get_classification("старый текст", "prompt", "fewshot") == {"domain_id": "house"}
+            assert cache.get_classification("другой текст", "prompt", "fewshot") is None
+            cache.set_classification("новый текст", "prompt", "fewshot", {"domain_id": "okc"})
+            cache.close()
+            
+            reloaded = LLMCache(cache_dir)
+            assert reloaded.get_classification("новый текст", "prompt", "fewshot") == {"domain_id": "okc"}
+            assert reloaded.get_classification("старый текст", "prompt", "fewshot") == {"domain_id": "house"}
+            reloaded.close()
+            print("   ✅ Старые и новые ключи находятся, в том числе после перезагрузки")
+            
+            # 4. QualityControl.detect_duplicates: точный дубликат находится
+            print("\n🛡️  QualityControl.detect_duplicates")
+            qc = QualityControl(QualityControlConfig())
+            duplicates = qc.detect_duplicates([
+                {"text": "передать показания счетчика"},
+                {"text": "передать показания счетчика"},
+                {"text": "оплатить питание в школе"},
+            ])
+            assert [(i, j) for i, j, _ in duplicates] == [(0, 1)], duplicates
+            assert duplicates[0][2] > 0.99
+            print("   ✅ Точный дубликат найден")
+        
+    except Exception as e:
+        print(f"   ❌ Ошибка: {e!r}")
+        return False
+    
+    return True
+
+
 async def test_full_pipeline():
     """Тестирует полный pipeline end-to-end"""
     
@@ -472,7 +655,12 @@ async def main():
         print("\n❌ Установите зависимости и попробуйте снова")
         return
     
-    # Тест 2: Компоненты
+    # Тест 2: Компоненты без LLM
+    if not test_config_loader() or not test_offline_components():
+        print("\n❌ Компоненты без LLM не прошли тест")
+        return
+    
+    # Тест 3: Компоненты
     components_ok = await test_components()
     
     if not components_ok:
@@ -480,7 +668,7 @@ async def main():
         print("💡 Проверьте .env конфигурацию")
         return
     
-    # Тест 3: Quality Control детально
+    # Тест 4: Quality Control детально
     await test_quality_control_detailed()
     
     # Финальное резюме